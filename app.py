@@ -1,127 +1,350 @@
+import time
+STARTED = time.perf_counter()
+
 import atexit
-from flask import Flask, jsonify, request, send_from_directory
-from pymongo import MongoClient
+import os
+import subprocess
+import sys
+import threading
+from flask import Flask, Response, jsonify, request, send_from_directory
+from pymongo import MongoClient, monitoring
 from datetime import datetime, UTC
-from collections import defaultdict
 from apscheduler.schedulers.background import BackgroundScheduler
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import csr_matrix
-import pickle
 
 from config import MONGO_URI, DATABASE_NAME, FEED_SIZE
-from recommendation_engine.engine import RecommendationEngine
+from recommendation_engine.engine import RecommendationEngine, FOR_YOU_SOURCES
+from recommendation_engine.seen_index import DEFAULT_USER_ID
+from recommendation_engine.neighbour_index import INDEX_PATH
+from recommendation_engine.embeddings import EMBEDDINGS_PATH
+from recommendation_engine.model_versions import current_path, read_manifest
+from recommendation_engine.model_builder import BUILT, SKIPPED
+from recommendation_engine.coordination import LeaderElection, MongoLease
+from recommendation_engine.feed_cache import FeedCache
+from recommendation_engine.cluster_popularity import refresh_cluster_rankings
+from recommendation_engine.personalization import POPULARITY_COLLECTION
+from recommendation_engine.ingestion import EventIngestor
+from recommendation_engine.items_payload import ItemsPayload, DEFAULT_PAGE_SIZE, GZIP_ETAG_SUFFIX
+from recommendation_engine.indexes import ensure_indexes
+from recommendation_engine.metrics import REGISTRY, PROFILER, PROFILER_INTERVAL_RANGE, HTTP_SECONDS, MongoCommandMetrics, stage
 
 # --- APP & DATABASE SETUP ---
+startup_timings = {'imports': time.perf_counter() - STARTED}
+phase = time.perf_counter()
 app = Flask(__name__, static_folder='static', static_url_path='')
+# Per-collection command latency; listeners must be registered before the client is created
+monitoring.register(MongoCommandMetrics())
 client = MongoClient(MONGO_URI)
 db = client[DATABASE_NAME]
+ensure_indexes(db)
 recommendation_engine = RecommendationEngine(db)
+recommendation_engine.catalog.watch_changes()
+startup_timings['engine'] = time.perf_counter() - phase
+phase = time.perf_counter()
+items_payload = ItemsPayload(recommendation_engine.catalog)
+items_payload.refresh()
+# Event writes are buffered and flushed to live_events in batches by a background thread
+event_ingestor = EventIngestor(db.live_events, on_written=[recommendation_engine.cluster_assigner.record_events])
+# Serialized /api/feed responses per user, refreshed in the background once they expire
+feed_cache = FeedCache()
+startup_timings['payload'] = time.perf_counter() - phase
+
+MODEL_UPDATES = REGISTRY.counter('feed_model_updates_total', "Recommendation model rebuilds by outcome.", ('outcome',))
+REGISTRY.callback('feed_event_queue_depth', "Events waiting in the write-behind queue.", event_ingestor.queue.qsize)
+REGISTRY.callback('feed_events_written_total', "Events written to live_events.", lambda: event_ingestor.written, kind='counter')
+REGISTRY.callback('feed_events_dropped_total', "Events shed because the queue was full.", lambda: event_ingestor.dropped, kind='counter')
+REGISTRY.callback('feed_events_failed_total', "Events lost to failed batch writes.", lambda: event_ingestor.failed, kind='counter')
+REGISTRY.callback('feed_cache_entries', "Responses held in the feed cache.", lambda: len(feed_cache))
 
 
 # --- AUTOMATIC MODEL UPDATE LOGIC ---
+MODEL_BUILD_IN_SUBPROCESS = True   # False builds in this process, e.g. against an in-memory test database
+MODEL_BUILD_TIMEOUT = 2 * 3600     # Seconds before a hung build process is killed
+MODEL_SYNC_SECONDS = 30            # How often every worker checks for model versions published by the builder
+model_build_lock = threading.Lock()
+# With several workers (e.g. gunicorn -w N) one elected process builds; the rest map what it publishes
+leader = LeaderElection()
+REGISTRY.callback('feed_model_builder_leader', "1 if this process is the elected model builder.", lambda: int(leader.is_leader))
+# Jobs that write shared MongoDB collections run in one process across all hosts, not one per host
+mongo_jobs = MongoLease(db, 'mongo_jobs')
+REGISTRY.callback('feed_mongo_jobs_leader', "1 if this process holds the lease for shared MongoDB jobs.", lambda: int(mongo_jobs.is_leader))
+
+def _run_model_build():
+    """Runs recommendation_engine.model_builder in a child process and returns its exit code."""
+    if not MODEL_BUILD_IN_SUBPROCESS:
+        from recommendation_engine.model_builder import build_models   # scipy and sklearn load only when a model is built
+        return SKIPPED if build_models(db) is None else BUILT
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = {
+        **os.environ,
+        'FEED_MONGO_URI': MONGO_URI,
+        'FEED_DATABASE_NAME': DATABASE_NAME,
+        'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])),
+    }
+    return subprocess.run([sys.executable, '-m', 'recommendation_engine.model_builder'], env=env, timeout=MODEL_BUILD_TIMEOUT).returncode
+
 def update_recommendation_model():
     """
     Builds the global item similarity model based ONLY on historical data from all customers.
+    The build runs in a separate process, which publishes new model versions; this process only
+    maps them once they are complete, so requests keep being served at full speed meanwhile.
     """
+    if not leader.try_acquire():
+        print("SCHEDULER: Another worker is the model builder. Skipping.")
+        return
+    if not model_build_lock.acquire(blocking=False):
+        print("SCHEDULER: A model build is already running. Skipping.")
+        return
     print("SCHEDULER: Starting recommendation model build from historical data...")
     try:
-        # 💡 CHANGED: Read ONLY from historical_events
-        events = list(db.historical_events.find({"action": {"$in": ["Seen", "Order"]}}))
+        with stage('model_update', 'build'): returncode = _run_model_build()
 
-        if not events:
+        if returncode == SKIPPED:
             print("SCHEDULER: No historical events found to build model. Skipping.")
+            MODEL_UPDATES.inc(outcome='skipped')
             return
+        if returncode != BUILT: raise RuntimeError(f"model build process exited with code {returncode}")
 
-        event_data = []
-        for event in events:
-            if event.get('detail') and event['detail'].get('order_number'):
-                try:
-                    event_data.append({
-                        'user_id': event.get('user_id'),
-                        'action': event.get('action'),
-                        'product_id': int(event['detail']['order_number'])
-                    })
-                except (ValueError, TypeError): continue
-        
-        df = pd.DataFrame(event_data)
-        if df.empty: return
-
-        df['interaction_strength'] = df['action'].apply(lambda x: 2.0 if x.lower() == 'order' else 1.0)
-        interaction_matrix = df.pivot_table(index='user_id', columns='product_id', values='interaction_strength').fillna(0)
-        
-        if interaction_matrix.empty: return
-            
-        sparse_matrix = csr_matrix(interaction_matrix.values)
-        item_similarity = cosine_similarity(sparse_matrix.T)
-        item_similarity_df = pd.DataFrame(item_similarity, index=interaction_matrix.columns, columns=interaction_matrix.columns)
-        
-        with open('recommendation_engine/item_similarity.pkl', 'wb') as f: pickle.dump(item_similarity_df, f)
-
-        recommendation_engine.collaborative_filter.load_matrix()
+        with stage('model_update', 'reload'):
+            if recommendation_engine.reload_models(): feed_cache.bump_generation('model')
+        MODEL_UPDATES.inc(outcome='success')
         print("SCHEDULER: Global recommendation model updated and reloaded successfully.")
 
     except Exception as e:
+        MODEL_UPDATES.inc(outcome='error')
         print(f"SCHEDULER: An error occurred during model update: {e}")
+    finally:
+        model_build_lock.release()
+
+
+def sync_models():
+    """
+    Maps model versions published by the elected builder (or by a compute script run by hand).
+    """
+    try:
+        if recommendation_engine.reload_models():
+            feed_cache.bump_generation('model')
+            print("SCHEDULER: Mapped newly published model versions.")
+    except Exception as e:
+        print(f"SCHEDULER: An error occurred during model sync: {e}")
+
+
+def refresh_cluster_popularity():
+    """
+    Folds newly arrived historical events into the materialized per-cluster rankings.
+    """
+    try:
+        # The rankings and product popularity live in MongoDB: the lease holder recomputes them and every worker re-reads them
+        writer = mongo_jobs.try_acquire()
+        if writer: refresh_cluster_rankings(db)
+        # Every step runs; cached feeds are only marked out of date if one of them changed something
+        changed = [
+            recommendation_engine.cluster_popularity.reload(),
+            recommendation_engine.personalization_filter.refresh_rankings(recount=writer),
+            recommendation_engine.cluster_assigner.refresh(),
+        ]
+        if any(changed): feed_cache.bump_generation('cluster_rankings')
+    except Exception as e:
+        print(f"SCHEDULER: An error occurred during cluster ranking refresh: {e}")
+
+
+def refresh_catalog():
+    """
+    Reloads the product catalog if its version changed and re-encodes the /api/items payload.
+    """
+    if recommendation_engine.catalog.refresh():
+        items_payload.refresh()
+        feed_cache.bump_generation('catalog')
+
+
+def refresh_trending():
+    """
+    The lease holder recounts trending over every worker's events; each worker then swaps in the shared snapshot.
+    Feeds cached before a new snapshot are refreshed with the new leaders.
+    """
+    try:
+        if mongo_jobs.try_acquire(): recommendation_engine.trending.publish()
+        if recommendation_engine.trending.reload(): feed_cache.bump_generation('trending')
+    except Exception as e:
+        print(f"SCHEDULER: An error occurred during trending refresh: {e}")
 
 
 # --- SCHEDULER CONFIGURATION ---
 scheduler = BackgroundScheduler()
 # The model only needs to be rebuilt periodically, not constantly
 scheduler.add_job(func=update_recommendation_model, trigger="interval", hours=1)
+scheduler.add_job(func=refresh_cluster_popularity, trigger="interval", minutes=10)
+scheduler.add_job(func=refresh_trending, trigger="interval", minutes=5)
+scheduler.add_job(func=refresh_catalog, trigger="interval", seconds=30)
+scheduler.add_job(func=sync_models, trigger="interval", seconds=MODEL_SYNC_SECONDS)
+# A worker starting next to an existing index maps it and serves at once; only a missing index is built now, off the request path
+if current_path(INDEX_PATH) is None:
+    scheduler.add_job(func=update_recommendation_model, next_run_time=datetime.now(UTC))
+# Likewise the shared trending snapshot and product popularity are only counted now if nobody has published them
+if recommendation_engine.trending.snapshot_at is None:
+    scheduler.add_job(func=refresh_trending, next_run_time=datetime.now(UTC))
+if db[POPULARITY_COLLECTION].find_one() is None:
+    scheduler.add_job(func=refresh_cluster_popularity, next_run_time=datetime.now(UTC))
 scheduler.start()
-atexit.register(lambda: scheduler.shutdown())
+
+# The full seen-items index is built while the worker already serves; until then it loads users one at a time
+threading.Thread(target=recommendation_engine.seen_index.build, name='seen-index-build', daemon=True).start()
+
+report = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_timings.items())
+print(f"STARTUP: Ready in {(time.perf_counter() - STARTED) * 1000:.0f} ms ({report}).")
+
+def shutdown():
+    PROFILER.stop()
+    scheduler.shutdown()
+    event_ingestor.close()
+    feed_cache.close()
+    leader.release()
+    mongo_jobs.release()
+
+atexit.register(shutdown)
 
 
 # --- API ROUTES ---
+@app.before_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = getattr(request, 'started_at', None)
+    # Labelled by route pattern, not raw path, so /api/feed/<user_id> stays a single series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if started is not None: HTTP_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/profile', methods=['GET', 'POST'])
+def sampling_profile():
+    # POST {"enabled": true, "interval": 0.005} starts the sampler, {"enabled": false} stops it;
+    # GET returns the collapsed stacks collected so far
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        interval = data.get('interval')
+        if interval is not None:
+            low, high = PROFILER_INTERVAL_RANGE
+            try: interval = float(interval)
+            except (TypeError, ValueError): interval = None
+            if interval is None or not low <= interval <= high:
+                return jsonify({"error": f"interval must be a number of seconds between {low} and {high}"}), 400
+        if data.get('enabled'): PROFILER.start(interval)
+        else: PROFILER.stop()
+        return jsonify({"enabled": PROFILER.enabled, "interval": PROFILER.interval, "samples": PROFILER.samples})
+    return Response(PROFILER.report(), mimetype='text/plain')
+
+@app.route('/api/model', methods=['GET'])
+def model_status():
+    # Versions mapped by this process, plus each model's published versions and build stats
+    return jsonify({
+        "pid": os.getpid(),
+        "builder": leader.is_leader,
+        "mongo_jobs": mongo_jobs.is_leader,
+        "loaded": recommendation_engine.model_versions(),
+        "published": {"item_similarity": read_manifest(INDEX_PATH), "embeddings": read_manifest(EMBEDDINGS_PATH)},
+    })
+
+@app.route('/api/model/rollback', methods=['POST'])
+def rollback_model():
+    # Serves the previous published versions until the next successful build publishes new ones
+    rolled_back = recommendation_engine.rollback_models()
+    if not any(rolled_back.values()): return jsonify({"error": "No earlier model version to roll back to"}), 409
+    feed_cache.bump_generation('model')
+    return jsonify({"rolled_back": rolled_back, "loaded": recommendation_engine.model_versions()})
+
 @app.route('/api/feed', methods=['GET'])
-def get_user_feed_separated():
+@app.route('/api/feed/<user_id>', methods=['GET'])
+def get_user_feed_separated(user_id=None):
     try:
-        recommendations = recommendation_engine.get_recommendations_separated()
-        def get_product_details(pids):
-            if not pids: return []
-            product_details = list(db.products.find({"product_id": {"$in": pids}}, {'_id': 0}))
-            product_map = {p['product_id']: p for p in product_details}
-            return [product_map.get(pid) for pid in pids if pid in product_map]
+        user_id = user_id or request.args.get('user_id', DEFAULT_USER_ID)
+        for_you = request.args.get('for_you')
+        if for_you is not None and for_you not in FOR_YOU_SOURCES:
+            return jsonify({"error": f"for_you must be one of {', '.join(FOR_YOU_SOURCES)}"}), 400
+        for_you = for_you or recommendation_engine.for_you
+        body, result = feed_cache.get(user_id, for_you, lambda: render_feed(user_id, for_you))
+        return Response(body, mimetype='application/json', headers={'X-Feed-Cache': result})
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+def render_feed(user_id, for_you):
+    # Precomputed by scripts/precompute_feeds.py; computed live for stale or missing users
+    recommendations = recommendation_engine.get_feed(user_id, FEED_SIZE, for_you)
+    # Product details come from the in-memory catalog, so no catalog queries are made here
+    catalog = recommendation_engine.catalog
+    return app.json.dumps({
+        "for_you": catalog.get_many(recommendations['collaborative']),
+        "based_on_watchlist": catalog.get_many(recommendations['self_feed']),
+        "trending": catalog.get_many(recommendations['trending'])
+    }).encode()
 
+@app.route('/api/similar/<int:product_id>', methods=['GET'])
+def get_similar_items(product_id):
+    try:
+        embeddings = recommendation_engine.embeddings
+        if embeddings is None: return jsonify({"error": "Embeddings have not been built yet"}), 503
+        n = min(max(request.args.get('n', 10, type=int), 1), 100)
+        nearest = embeddings.similar(product_id, n)
+        if nearest is None: return jsonify({"error": "Product not found"}), 404
+        products = recommendation_engine.catalog.products
         return jsonify({
-            "for_you": get_product_details(recommendations['collaborative']),
-            "based_on_watchlist": get_product_details(recommendations['self_feed']),
-            "trending": get_product_details(recommendations['trending'])
+            "product_id": product_id,
+            "similar": [{**products[pid], "score": round(score, 4)} for pid, score in nearest if pid in products]
         })
     except Exception as e: return jsonify({"error": str(e)}), 500
 
 @app.route('/api/items', methods=['GET'])
 def get_all_items_grouped():
     try:
-        products_from_db = list(db.products.find({}, {'_id': 0}))
-        grouped_products = defaultdict(list)
-        for product in products_from_db:
-            category = product.get('category', 'Uncategorized')
-            formatted_product = { 'order_number': product.get('product_id', 0), 'product': product.get('product_name', 'No Name'), 'brand': product.get('brand', 'No Brand') }
-            grouped_products[category].append(formatted_product)
-        return jsonify(grouped_products)
+        # Read once: the body, ETag and pages below all come from the same catalog version
+        snapshot = items_payload.refresh()
+        # Paginated form: /api/items?category=SSD&cursor=<last product id>&limit=50
+        category = request.args.get('category')
+        if category is not None:
+            cursor = request.args.get('cursor', type=int)
+            limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+            return jsonify(items_payload.page(category, cursor, limit, snapshot=snapshot))
+
+        # Full grouped catalog, served from pre-encoded bytes
+        if 'gzip' in request.accept_encodings:
+            body, etag, headers = snapshot.compressed, snapshot.etag + GZIP_ETAG_SUFFIX, {'Content-Encoding': 'gzip'}
+        else:
+            body, etag, headers = snapshot.plain, snapshot.etag, {}
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json', headers=headers)
+        response.set_etag(etag)
+        response.headers.update({'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'})
+        return response
     except Exception as e: return jsonify({"error": str(e)}), 500
 
-# 💡 Both logging functions now correctly write ONLY to live_events
+# 💡 Both logging functions now correctly write ONLY to live_events, through the write-behind ingestor
+def enqueue_event(event):
+    if not event_ingestor.submit(event): return jsonify({"error": "Event queue is full, try again later"}), 503
+    recommendation_engine.record_event(event)
+    feed_cache.invalidate_user(event['user_id'])
+    return jsonify({"status": "success"}), 201
+
 @app.route('/api/event', methods=['POST'])
 def log_event():
     data = request.json
     if not all(k in data for k in ['action', 'product_id']): return jsonify({"error": "Missing required fields"}), 400
     product_id = int(data['product_id'])
-    product_details = db.products.find_one({"product_id": product_id}, {'_id': 0})
+    product_details = recommendation_engine.catalog.get(product_id)
     if not product_details: return jsonify({"error": "Product not found"}), 404
-    event = { "action": data['action'].capitalize(), "detail": { "category": product_details.get('category'), "order_number": str(product_id), "product": product_details.get('product_name'), "brand": product_details.get('brand') }, "clientTimestamp": datetime.now(UTC).isoformat().replace('+00:00', 'Z'), "serverTimestamp": datetime.now(UTC) }
-    db.live_events.insert_one(event)
-    return jsonify({"status": "success"}), 201
+    event = { "user_id": data.get('user_id', DEFAULT_USER_ID), "action": data['action'].capitalize(), "detail": { "category": product_details.get('category'), "order_number": str(product_id), "product": product_details.get('product_name'), "brand": product_details.get('brand') }, "clientTimestamp": datetime.now(UTC).isoformat().replace('+00:00', 'Z'), "serverTimestamp": datetime.now(UTC) }
+    return enqueue_event(event)
 
 @app.route('/api/log', methods=['POST'])
 def log_action():
     data = request.json
     if not all(k in data for k in ['action', 'detail', 'clientTimestamp']): return jsonify({"error": "Missing required fields"}), 400
-    event = { "action": data['action'], "detail": data['detail'], "clientTimestamp": data['clientTimestamp'], "serverTimestamp": datetime.now(UTC) }
-    db.live_events.insert_one(event)
-    return jsonify({"status": "success"}), 201
+    event = { "user_id": data.get('user_id', DEFAULT_USER_ID), "action": data['action'], "detail": data['detail'], "clientTimestamp": data['clientTimestamp'], "serverTimestamp": datetime.now(UTC) }
+    return enqueue_event(event)
 
 # --- FRONTEND SERVING ROUTES ---
 @app.route('/')
@@ -130,5 +353,4 @@ def serve_index(): return send_from_directory(app.static_folder, 'index.html')
 def serve_static_files(path): return send_from_directory(app.static_folder, path)
 
 if __name__ == '__main__':
-    update_recommendation_model()
     app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,207 @@
+# benchmarks/run_benchmarks.py
+"""
+End-to-end benchmark of the offline jobs and the request path on synthetic data.
+
+    python -m benchmarks.run_benchmarks --events 100000 --output results.json
+    python -m benchmarks.run_benchmarks --events 1000000 --mongo-uri mongodb://localhost:27017 --baseline results.json
+
+Everything runs in a scratch working directory (model artifacts) and a scratch database, so the
+real data and models are never touched. The default Mongo stand-in is mongomock (pip install mongomock).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, UTC
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path: sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic_data import generate_csv
+
+DEFAULT_DATABASE = 'ecommerce_feed_benchmark'
+
+
+def use_mongo(uri, database):
+    """Points config (and, for mongomock, pymongo itself) at the benchmark database before any job module is imported."""
+    import config
+    import pymongo
+    if uri == 'mongomock':
+        try: import mongomock
+        except ImportError: sys.exit("mongomock is not installed; pip install mongomock or pass --mongo-uri mongodb://...")
+        shared = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: shared   # Every module shares one in-memory server
+    else:
+        config.MONGO_URI = uri
+    config.DATABASE_NAME = database
+    return pymongo.MongoClient(config.MONGO_URI)[database]
+
+
+def timed(name, timings, func, *args, **kwargs):
+    print(f"BENCHMARK: Running {name}...")
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[name] = round(time.perf_counter() - started, 4)
+    print(f"BENCHMARK: {name} took {timings[name]:.2f}s")
+    return result
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'n': len(samples), 'mean_ms': round(float(samples.mean()), 3), 'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3)}
+
+
+def bench_feeds(app, user_ids, n_requests, rng, feed_size):
+    latencies = []
+    engine = app.recommendation_engine
+    for user_id in rng.choice(user_ids, size=n_requests):
+        started = time.perf_counter()
+        engine.get_recommendations_separated(str(user_id), feed_size)
+        latencies.append(time.perf_counter() - started)
+    return percentiles(latencies)
+
+
+def bench_events(app, user_ids, product_ids, n_requests, rng):
+    """POSTs /api/event through the Flask test client; throughput includes draining the write-behind queue."""
+    client = app.app.test_client()
+    statuses, latencies = {}, []
+    bodies = [{'action': 'seen', 'product_id': int(p), 'user_id': str(u)}
+              for u, p in zip(rng.choice(user_ids, size=n_requests), rng.choice(product_ids, size=n_requests))]
+    started = time.perf_counter()
+    for body in bodies:
+        request_started = time.perf_counter()
+        status = client.post('/api/event', json=body).status_code
+        latencies.append(time.perf_counter() - request_started)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    accepted_in = time.perf_counter() - started
+    app.event_ingestor.close()   # Waits for every accepted event to reach live_events
+    drained_in = time.perf_counter() - started
+    return {
+        'requests': n_requests,
+        'statuses': statuses,
+        'requests_per_s': round(n_requests / max(accepted_in, 1e-9), 1),
+        'persisted_per_s': round(statuses.get('201', 0) / max(drained_in, 1e-9), 1),
+        'latency': percentiles(latencies),
+    }
+
+
+def check_items_invalidation(app, db, product_id):
+    """
+    An in-place product update must change the /api/items ETag. The stale flag is what the catalog's
+    change stream sets on a write (mongomock has no change streams, so it is set here directly).
+    """
+    client = app.app.test_client()
+    before = client.get('/api/items').headers['ETag']
+    db.products.update_one({'product_id': product_id}, {'$set': {'product_name': 'Benchmark rename'}})
+    app.recommendation_engine.catalog.stale.set()
+    app.refresh_catalog()
+    response = client.get('/api/items', headers={'If-None-Match': before})
+    if response.status_code == 304 or response.headers['ETag'] == before:
+        raise RuntimeError("/api/items kept serving the old ETag after a product update")
+    print("BENCHMARK: /api/items ETag changed after an in-place product update.")
+
+
+def compare(results, baseline_path):
+    """Prints each timing next to the baseline run's, slower runs first."""
+    with open(baseline_path) as f: baseline = json.load(f)
+    rows = []
+    for name, seconds in results['timings'].items():
+        before = baseline.get('timings', {}).get(name)
+        if before: rows.append((seconds / before, name, before, seconds))
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        before = baseline.get('feed_latency', {}).get(key)
+        if before: rows.append((results['feed_latency'][key] / before, f"feed {key}", before, results['feed_latency'][key]))
+    for ratio, name, before, after in sorted(rows, reverse=True):
+        print(f"  {name:<32} {before:>10.3f} -> {after:>10.3f}  ({ratio:.2f}x)")
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    workdir = tempfile.mkdtemp(prefix='feed-benchmark-')
+    original_cwd = os.getcwd()
+    # Artifact paths in the code are relative, so the scratch directory gets the same layout
+    os.makedirs(os.path.join(workdir, 'recommendation_engine'))
+    csv_path = os.path.join(workdir, 'events.csv')
+    timings = {}
+    try:
+        os.chdir(workdir)
+        db = use_mongo(args.mongo_uri, args.database)
+        from config import FEED_SIZE
+
+        rows = timed('generate_csv', timings, generate_csv, csv_path, args.events, args.users, args.products, args.user_skew, args.product_skew, args.seed)
+
+        from scripts.load_data import populate_database
+        from scripts.compute_user_clusters import create_user_clusters
+        from recommendation_engine.similarity_builder import build_item_similarity
+        from recommendation_engine.neighbour_index import write_neighbour_index
+
+        timed('populate_database', timings, populate_database, csv_path)
+        timed('compute_user_clusters', timings, create_user_clusters)
+        # An index must exist before app is imported, otherwise its startup build would race the timed one
+        write_neighbour_index(*build_item_similarity(db.historical_events))
+
+        app = timed('app_startup', timings, __import__, 'app')
+        app.scheduler.pause()   # Keep the periodic jobs out of the measurements
+        # A builder process could not see an in-memory database; against mongod the real subprocess build is timed
+        app.MODEL_BUILD_IN_SUBPROCESS = args.mongo_uri != 'mongomock'
+        timed('update_recommendation_model', timings, app.update_recommendation_model)
+        # Shared counts a fresh database has not published yet; a worker's startup only schedules these
+        timed('refresh_cluster_popularity', timings, app.refresh_cluster_popularity)
+        timed('refresh_trending', timings, app.refresh_trending)
+        timed('seen_index_ready', timings, app.recommendation_engine.seen_index.ready.wait)
+
+        user_ids = [u['user_id'] for u in db.users.find({}, {'_id': 0, 'user_id': 1})]
+        product_ids = [p['product_id'] for p in db.products.find({}, {'_id': 0, 'product_id': 1})]
+        feed_latency = bench_feeds(app, user_ids, args.feed_requests, rng, FEED_SIZE)
+        event_ingestion = bench_events(app, user_ids, product_ids, args.event_requests, rng)
+        check_items_invalidation(app, db, product_ids[0])
+
+        results = {
+            'created_at': datetime.now(UTC).isoformat().replace('+00:00', 'Z'),
+            'params': {**vars(args), 'csv_rows': rows, 'historical_events': db.historical_events.count_documents({})},
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'mongo': 'mongomock' if args.mongo_uri == 'mongomock' else 'mongod'},
+            'timings': timings,
+            'feed_latency': feed_latency,
+            'event_ingestion': event_ingestion,
+        }
+        if args.mongo_uri != 'mongomock' and not args.keep_database: db.client.drop_database(args.database)
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f: json.dump(results, f, indent=2)
+    print(f"BENCHMARK: Feed latency p50 {feed_latency['p50_ms']:.1f} ms, p95 {feed_latency['p95_ms']:.1f} ms, p99 {feed_latency['p99_ms']:.1f} ms")
+    print(f"BENCHMARK: /api/event {event_ingestion['requests_per_s']:.0f} req/s, {event_ingestion['persisted_per_s']:.0f} events/s persisted")
+    print(f"BENCHMARK: Results written to '{args.output}'.")
+    if args.baseline: compare(results, args.baseline)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the feed service on synthetic data.")
+    parser.add_argument('--events', type=int, default=10000, help="Historical events to generate (10^4 - 10^7)")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--user-skew', type=float, default=1.0, help="Zipf exponent for user activity; 0 is uniform")
+    parser.add_argument('--product-skew', type=float, default=1.0, help="Zipf exponent for product popularity; 0 is uniform")
+    parser.add_argument('--feed-requests', type=int, default=500)
+    parser.add_argument('--event-requests', type=int, default=2000)
+    parser.add_argument('--mongo-uri', default='mongomock', help="'mongomock' or a mongodb:// URI of a local mongod")
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help="Scratch database; dropped afterwards unless --keep-database")
+    parser.add_argument('--keep-database', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+    run(args)
+
+if __name__ == "__main__":
+    main()
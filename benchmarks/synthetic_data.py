@@ -0,0 +1,67 @@
+# benchmarks/synthetic_data.py
+import numpy as np
+import pandas as pd
+
+# Same columns as data/Online-eCommerce.csv, so scripts/load_data.py reads the output unchanged
+COLUMNS = [
+    'Order_Number', 'State_Code', 'Customer_Name', 'Order_Date', 'Status', 'Product', 'Category', 'Brand',
+    'Cost', 'Sales', 'Quantity', 'Total_Cost', 'Total_Sales', 'Assigned Supervisor',
+]
+CATEGORIES = ['SSD', 'CPU', 'GPU', 'RAM', 'Motherboard', 'Monitor', 'Keyboard', 'Mouse', 'HDD', 'PSU', 'Cabinet', 'Cooler', 'Printer', 'Headset']
+BRANDS = ['Samsung', 'Intel', 'AMD', 'Nvidia', 'Corsair', 'Logitech', 'Asus', 'MSI', 'Gigabyte', 'Dell', 'HP']
+STATES = ['AP', 'KA', 'TN', 'MH', 'DL', 'GJ', 'RJ', 'UP', 'WB', 'KL']
+STATUSES = ['Delivered', 'Cancelled', 'Returned', 'In Transit']
+SUPERVISORS = ['Ajay Sharma', 'Roshan Kumar', 'Priya Nair', 'Sneha Rao', 'Vikram Singh', 'Meera Iyer']
+CHUNK_ROWS = 500000       # Rows generated and written at a time
+FIRST_PRODUCT_ID = 100000
+
+
+def zipf_probabilities(n, skew):
+    """Probability of each of n ranks under a Zipf-like law; skew 0 is uniform, around 1 is heavily skewed."""
+    weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** skew
+    return weights / weights.sum()
+
+
+def generate_csv(path, n_events, n_users=1000, n_products=5000, user_skew=1.0, product_skew=1.0, seed=42):
+    """
+    Writes an Online-eCommerce-style CSV that load_data.py turns into about n_events historical events
+    (it writes an Order and a Seen event per row). Users and products are drawn with Zipf-like skew;
+    every product keeps one name, category and brand across rows. Returns the number of rows written.
+    """
+    rng = np.random.default_rng(seed)
+    rows = max(1, n_events // 2)
+    user_p = zipf_probabilities(n_users, user_skew)
+    product_p = zipf_probabilities(n_products, product_skew)
+    product_category = rng.integers(0, len(CATEGORIES), size=n_products)
+    product_brand = rng.integers(0, len(BRANDS), size=n_products)
+    product_cost = rng.integers(5, 200, size=n_products) * 100
+    start = np.datetime64('2019-01-01')
+
+    written = 0
+    while written < rows:
+        size = min(CHUNK_ROWS, rows - written)
+        users = rng.choice(n_users, size=size, p=user_p)
+        products = rng.choice(n_products, size=size, p=product_p)
+        quantity = rng.integers(1, 5, size=size)
+        cost = product_cost[products]
+        sales = (cost * 1.3).astype(np.int64)
+        dates = pd.to_datetime(start + rng.integers(0, 730, size=size).astype('timedelta64[D]'))
+        chunk = pd.DataFrame({
+            'Order_Number': FIRST_PRODUCT_ID + products,
+            'State_Code': np.array(STATES)[rng.integers(0, len(STATES), size=size)],
+            'Customer_Name': np.char.add('Customer ', users.astype(str)),
+            'Order_Date': dates.strftime('%d/%m/%Y'),
+            'Status': np.array(STATUSES)[rng.integers(0, len(STATUSES), size=size)],
+            'Product': np.char.add('Product ', products.astype(str)),
+            'Category': np.array(CATEGORIES)[product_category[products]],
+            'Brand': np.array(BRANDS)[product_brand[products]],
+            'Cost': cost,
+            'Sales': sales,
+            'Quantity': quantity,
+            'Total_Cost': cost * quantity,
+            'Total_Sales': sales * quantity,
+            'Assigned Supervisor': np.array(SUPERVISORS)[rng.integers(0, len(SUPERVISORS), size=size)],
+        }, columns=COLUMNS)
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += size
+    return written
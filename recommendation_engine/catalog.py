@@ -0,0 +1,74 @@
+# recommendation_engine/catalog.py
+from datetime import datetime, UTC
+import threading
+
+STATE_ID = 'catalog'
+CURSOR_BATCH_SIZE = 5000
+
+
+def bump_catalog_version(db):
+    """Marks the product catalog as changed so every ProductCatalog reloads on its next refresh."""
+    db.model_state.update_one({'_id': STATE_ID}, {'$inc': {'version': 1}, '$set': {'updated_at': datetime.now(UTC)}}, upsert=True)
+
+
+class ProductCatalog:
+    """
+    In-process copy of db.products with id -> product and category -> product ids indexes.
+    Reads never touch the database. refresh() compares a version stamp stored in db.model_state
+    and reloads only when scripts/load_data.py has bumped it or a change stream saw a write.
+    Consumers compare against reloads, which moves on every reload whichever of the two caused it.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.version = None               # model_state stamp of the loaded copy
+        self.reloads = 0
+        self.stale = threading.Event()    # set by the change stream
+        self.products = {}
+        self.by_category = {}
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def current_version(self):
+        state = self.db.model_state.find_one({'_id': STATE_ID}, {'version': 1})
+        return state.get('version', 0) if state else 0
+
+    def refresh(self):
+        """Reloads the catalog if its version stamp changed. Returns True when a reload happened."""
+        version = self.current_version()
+        if version == self.version and not self.stale.is_set(): return False
+        with self.lock:
+            if version == self.version and not self.stale.is_set(): return False
+            # Cleared before reading, so a write that lands during the load triggers another one
+            self.stale.clear()
+            products, by_category = {}, {}
+            for product in self.db.products.find({}, {'_id': 0}, batch_size=CURSOR_BATCH_SIZE):
+                products[product.get('product_id')] = product
+                by_category.setdefault(product.get('category', 'Uncategorized'), []).append(product.get('product_id'))
+            self.products, self.by_category, self.version = products, by_category, version
+            self.reloads += 1
+        print(f"CATALOG: Loaded {len(products)} products (version {version}).")
+        return True
+
+    def get(self, product_id):
+        return self.products.get(product_id)
+
+    def get_many(self, product_ids):
+        """Products for the given ids, in the same order, skipping unknown ids."""
+        products = self.products
+        return [products[pid] for pid in product_ids if pid in products]
+
+    def watch_changes(self):
+        """
+        Optional change-stream listener. Any write to db.products marks this copy stale, and the
+        next refresh() reloads it even if nobody bumped the version. Change streams need a replica
+        set; on a standalone server this returns and version polling remains the only trigger.
+        """
+        def run():
+            try:
+                with self.db.products.watch() as stream:
+                    for _ in stream: self.stale.set()
+            except Exception as e:
+                print(f"CATALOG: Change stream unavailable, relying on version polling ({e}).")
+        thread = threading.Thread(target=run, name='catalog-watcher', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,110 @@
+# recommendation_engine/cluster_assignment.py
+import os
+import threading
+import numpy as np
+from pymongo import UpdateOne
+from .seen_index import DEFAULT_USER_ID, user_events_query
+
+MODEL_PATH = 'recommendation_engine/cluster_model.npz'
+
+
+def save_cluster_model(categories, scaler, kmeans, path=MODEL_PATH):
+    """Stores the fitted scaler and centroids as a small .npz, replacing the old file atomically."""
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(
+        tmp_path,
+        categories=np.array(categories, dtype=str),
+        mean=scaler.mean_.astype(np.float64),
+        scale=scaler.scale_.astype(np.float64),
+        centroids=kmeans.cluster_centers_.astype(np.float64),
+    )
+    os.replace(tmp_path, path)
+
+
+class ClusterAssigner:
+    """
+    Online nearest-centroid assignment for users the offline clustering job has not seen yet.
+    Each such user's category-count vector is kept in memory and updated per written batch of events;
+    the user is re-assigned in O(categories x clusters) and the cluster_id is persisted only when it changes.
+    """
+    def __init__(self, db, model_path=MODEL_PATH):
+        self.db = db
+        self.model_path = model_path
+        self.users = {}       # user_id -> category-count vector, or None when clustered offline
+        self.clusters = {}    # user_id -> online cluster id
+        self.lock = threading.Lock()
+        self.loaded_mtime = None
+        self.load_model()
+
+    def refresh(self):
+        """Reloads the model if compute_user_clusters.py has written a new one. Returns True if it did."""
+        try: mtime = os.path.getmtime(self.model_path)
+        except OSError: return False
+        if mtime == self.loaded_mtime: return False
+        self.load_model()
+        return True
+
+    def load_model(self):
+        try:
+            self.loaded_mtime = os.path.getmtime(self.model_path)
+            with np.load(self.model_path) as model:
+                categories = model['categories'].tolist()
+                self.mean, self.scale, self.centroids = model['mean'], model['scale'], model['centroids']
+            self.category_index = {category: i for i, category in enumerate(categories)}
+            print(f"CLUSTER_ASSIGNER: Loaded {len(self.centroids)} centroids over {len(categories)} categories.")
+        except FileNotFoundError:
+            self.category_index, self.centroids = {}, None
+        with self.lock: self.users, self.clusters = {}, {}
+
+    def _initial_counts(self, user_id):
+        """First event for a user in this process: skip offline-clustered users, otherwise count their live events."""
+        profile = self.db.users.find_one({'user_id': user_id}, {'_id': 0, 'cluster_id': 1, 'online_cluster': 1})
+        if profile and 'cluster_id' in profile and not profile.get('online_cluster'): return None
+        counts = np.zeros(len(self.category_index), dtype=np.float64)
+        pipeline = [{'$match': user_events_query(user_id)}, {'$group': {'_id': '$detail.category', 'count': {'$sum': 1}}}]
+        for doc in self.db.live_events.aggregate(pipeline):
+            index = self.category_index.get(doc['_id'])
+            if index is not None: counts[index] += doc['count']
+        return counts
+
+    def assign(self, counts):
+        scaled = (counts - self.mean) / self.scale
+        return int(np.argmin(((self.centroids - scaled) ** 2).sum(axis=1)))
+
+    @staticmethod
+    def _category(event):
+        detail = event.get('detail')
+        return detail.get('category') if isinstance(detail, dict) else None
+
+    def record_events(self, events):
+        """
+        EventIngestor on_written callback: runs on the writer thread once the batch is in live_events,
+        so the first-event seeding query and the cluster_id writes stay off the request path.
+        """
+        if self.centroids is None: return
+        seeded = set()   # Users seeded from live_events during this batch: the seed already counts the whole batch
+        before = {}      # user_id -> cluster at the start of the batch
+        for event in events:
+            index = self.category_index.get(self._category(event))
+            if index is None: continue
+            user_id = event.get('user_id', DEFAULT_USER_ID)
+            if user_id not in self.users:
+                counts = self._initial_counts(user_id)
+                with self.lock: self.users.setdefault(user_id, counts)
+                seeded.add(user_id)
+            with self.lock:
+                counts = self.users.get(user_id)   # None for offline-clustered users, missing after a model reload
+                if counts is None: continue
+                if user_id not in seeded: counts[index] += 1
+                before.setdefault(user_id, self.clusters.get(user_id))
+                self.clusters[user_id] = self.assign(counts)
+        with self.lock: changes = {u: self.clusters[u] for u, cluster_id in before.items() if self.clusters.get(u, cluster_id) != cluster_id}
+        if changes:
+            self.db.users.bulk_write([
+                UpdateOne({'user_id': user_id}, {'$set': {'cluster_id': cluster_id, 'online_cluster': True}}, upsert=True)
+                for user_id, cluster_id in changes.items()
+            ], ordered=False)
+
+    def cluster_for(self, user_id):
+        """The user's online cluster, or None if the user has no online assignment."""
+        return self.clusters.get(user_id)
@@ -0,0 +1,161 @@
+# recommendation_engine/cluster_popularity.py
+from collections import defaultdict, Counter
+from datetime import datetime, UTC
+import heapq
+from pymongo import UpdateOne, DESCENDING
+
+RANKING_SIZE = 500        # Ranked products kept per cluster
+WRITE_BATCH_SIZE = 1000
+CURSOR_BATCH_SIZE = 5000
+STATE_ID = 'cluster_rankings'
+LOAD_STATE_ID = 'historical_load'   # Written by scripts/load_data.py around each bulk load of historical_events
+
+
+def _cluster_product_counts(db, id_range):
+    """
+    Counts events per (cluster, product) on the server: events are grouped per (user, product),
+    joined to the user's cluster_id and regrouped, so only the per-cluster counts are transferred.
+    Yields (cluster_id, product_id, count).
+    """
+    pipeline = [
+        {'$match': {'_id': id_range}},
+        {'$group': {'_id': {'user_id': '$user_id', 'order_number': '$detail.order_number'}, 'count': {'$sum': 1}}},
+        {'$lookup': {'from': 'users', 'localField': '_id.user_id', 'foreignField': 'user_id', 'as': 'user'}},
+        {'$unwind': '$user'},
+        {'$match': {'user.cluster_id': {'$exists': True}}},
+        {'$group': {'_id': {'cluster_id': '$user.cluster_id', 'order_number': '$_id.order_number'}, 'count': {'$sum': '$count'}}},
+    ]
+    for doc in db.historical_events.aggregate(pipeline, allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE):
+        try: product_id = int(doc['_id']['order_number'])
+        except (KeyError, ValueError, TypeError): continue
+        yield doc['_id']['cluster_id'], product_id, doc['count']
+
+
+def begin_history_load(db):
+    """Called before historical_events is dropped and reloaded: counting pauses and restarts from scratch."""
+    db.model_state.update_one({'_id': LOAD_STATE_ID}, {'$set': {'loading': True, 'started_at': datetime.now(UTC)}}, upsert=True)
+    db.model_state.delete_one({'_id': STATE_ID})
+
+
+def end_history_load(db):
+    """Called once every insert of the load has returned, so every _id up to the newest one is committed."""
+    db.model_state.update_one({'_id': LOAD_STATE_ID}, {'$set': {'loading': False, 'loaded_at': datetime.now(UTC)}}, upsert=True)
+
+
+def _last_event_id(db):
+    """
+    The _id up to which historical events may be counted: the newest one, unless a bulk load is running.
+    Parallel unordered inserts commit out of _id order, so mid-load the newest _id can have lower ones
+    still in flight that a later $gt query would skip for good; the watermark is None until it ends.
+    """
+    load = db.model_state.find_one({'_id': LOAD_STATE_ID}, {'loading': 1})
+    if load is not None and load.get('loading'): return None
+    last = list(db.historical_events.find({}, {'_id': 1}).sort('_id', DESCENDING).limit(1))
+    return last[0]['_id'] if last else None
+
+
+def _ranked_from_counts(db, cluster_id):
+    top = db.cluster_product_counts.find(
+        {'cluster_id': cluster_id}, {'_id': 0, 'product_id': 1}
+    ).sort([('count', DESCENDING), ('product_id', 1)]).limit(RANKING_SIZE)
+    return [d['product_id'] for d in top]
+
+
+def _write_rankings(db, rankings):
+    """Stores {cluster_id: ranked product ids} in db.cluster_rankings."""
+    for cluster_id, product_ids in rankings.items():
+        db.cluster_rankings.update_one(
+            {'cluster_id': cluster_id},
+            {'$set': {'product_ids': product_ids, 'updated_at': datetime.now(UTC)}},
+            upsert=True
+        )
+
+
+def rebuild_cluster_rankings(db):
+    """
+    Recounts product popularity per cluster from all historical events and materializes
+    a ranked product list per cluster_id. Run after users are (re)clustered.
+    """
+    watermark = _last_event_id(db)
+    if watermark is None:
+        print("CLUSTER_RANKINGS: No completely loaded historical events found. Skipping.")
+        return 0
+
+    counts = defaultdict(Counter)
+    for cluster_id, product_id, count in _cluster_product_counts(db, {'$lte': watermark}):
+        counts[cluster_id][product_id] += count
+
+    db.cluster_product_counts.drop()
+    db.cluster_product_counts.create_index([('cluster_id', 1), ('count', DESCENDING)])
+    db.cluster_product_counts.create_index([('cluster_id', 1), ('product_id', 1)], unique=True)
+    batch = []
+    for cluster_id, counter in counts.items():
+        for product_id, count in counter.items():
+            batch.append({'cluster_id': cluster_id, 'product_id': product_id, 'count': count})
+            if len(batch) >= WRITE_BATCH_SIZE:
+                db.cluster_product_counts.insert_many(batch, ordered=False)
+                batch = []
+    if batch: db.cluster_product_counts.insert_many(batch, ordered=False)
+
+    # A full rebuild already holds every count, so clusters are ranked in memory rather than queried back
+    db.cluster_rankings.delete_many({'cluster_id': {'$nin': list(counts)}})
+    _write_rankings(db, {
+        cluster_id: [pid for pid, _ in heapq.nsmallest(RANKING_SIZE, counter.items(), key=lambda kv: (-kv[1], kv[0]))]
+        for cluster_id, counter in counts.items()
+    })
+    db.model_state.update_one({'_id': STATE_ID}, {'$set': {'last_event_id': watermark, 'refreshed_at': datetime.now(UTC)}}, upsert=True)
+    print(f"CLUSTER_RANKINGS: Materialized rankings for {len(counts)} clusters.")
+    return len(counts)
+
+
+def refresh_cluster_rankings(db):
+    """
+    Folds historical events added since the last run into the per-cluster counts and
+    re-ranks only the clusters they touched. Falls back to a full rebuild on first run.
+    """
+    state = db.model_state.find_one({'_id': STATE_ID})
+    if not state or 'last_event_id' not in state:
+        return rebuild_cluster_rankings(db)
+
+    watermark = _last_event_id(db)
+    if watermark is None or watermark <= state['last_event_id']: return 0
+
+    id_range = {'$gt': state['last_event_id'], '$lte': watermark}
+    increments = Counter()
+    for cluster_id, product_id, count in _cluster_product_counts(db, id_range):
+        increments[(cluster_id, product_id)] += count
+
+    ops = [UpdateOne({'cluster_id': c, 'product_id': p}, {'$inc': {'count': n}}, upsert=True) for (c, p), n in increments.items()]
+    for start in range(0, len(ops), WRITE_BATCH_SIZE):
+        db.cluster_product_counts.bulk_write(ops[start:start + WRITE_BATCH_SIZE], ordered=False)
+
+    touched = {c for c, _ in increments}
+    _write_rankings(db, {cluster_id: _ranked_from_counts(db, cluster_id) for cluster_id in touched})
+    db.model_state.update_one({'_id': STATE_ID}, {'$set': {'last_event_id': watermark, 'refreshed_at': datetime.now(UTC)}})
+    print(f"CLUSTER_RANKINGS: Folded new events up to {watermark} into {len(touched)} clusters.")
+    return len(touched)
+
+
+class ClusterPopularity:
+    """In-memory table of the materialized per-cluster rankings, read on the request path."""
+    def __init__(self, db):
+        self.db = db
+        self.rankings = {}
+        self.updated_at = None
+        self.reload()
+
+    def reload(self):
+        """Swaps in the latest rankings from db.cluster_rankings. Returns True if any were rewritten since the last reload."""
+        latest = list(self.db.cluster_rankings.find({}, {'_id': 0, 'updated_at': 1}).sort('updated_at', DESCENDING).limit(1))
+        updated_at = latest[0].get('updated_at') if latest else None
+        if updated_at == self.updated_at: return False
+        self.rankings = {d['cluster_id']: d.get('product_ids', []) for d in self.db.cluster_rankings.find({}, {'_id': 0})}
+        self.updated_at = updated_at
+        return True
+
+    def get_ranked_products(self, cluster_id):
+        if cluster_id not in self.rankings:
+            doc = self.db.cluster_rankings.find_one({'cluster_id': cluster_id}, {'_id': 0, 'product_ids': 1})
+            if not doc: return []
+            self.rankings[cluster_id] = doc.get('product_ids', [])
+        return self.rankings[cluster_id]
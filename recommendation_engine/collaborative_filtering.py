@@ -1,47 +1,128 @@
 # recommendation_engine/collaborative_filtering.py
-import pandas as pd
-import pickle
+import numpy as np
 from config import N_SIMILAR_ITEMS
+from .neighbour_index import NeighbourIndex, INDEX_PATH
+from .model_versions import rollback
+
+# Upper bound on users x items cells densified at once by get_scores_batch
+BATCH_DENSE_CELLS = 8_000_000
 
 class CollaborativeFiltering:
-    def __init__(self):
-        self.matrix_path = 'recommendation_engine/item_similarity.pkl'
-        self.similarity_matrix = pd.DataFrame()
+    def __init__(self, index_path=INDEX_PATH):
+        self.index_path = index_path
+        self.index = None
         self.load_matrix() # Load the model when the class is created
 
+    @property
+    def version(self):
+        index = self.index
+        return index.version if index is not None else None
+
     def load_matrix(self):
-        """Loads or reloads the similarity matrix from the file."""
+        """
+        Maps the version the manifest points at. Only the file mappings are created here, and the model
+        is swapped in with a single reference assignment: a request holds on to the index it started
+        with, so it never mixes two versions. Returns True if a different version was loaded.
+        """
         try:
-            with open(self.matrix_path, 'rb') as f:
-                self.similarity_matrix = pickle.load(f)
-                print("Collaborative filtering model loaded/reloaded successfully.")
+            index = NeighbourIndex(self.index_path)
         except FileNotFoundError:
-            print(f"Warning: {self.matrix_path} not found. Run the compute script first.")
-            self.similarity_matrix = pd.DataFrame()
+            # Keep serving whatever is already mapped
+            if self.index is None: print(f"Warning: {self.index_path} not found. Run the compute script first.")
+            return False
+        if index.version == self.version: return False
+        self.index = index
+        print(f"Collaborative filtering model {index.version} loaded.")
+        return True
+
+    def rollback(self):
+        """Points the manifest back at the previous version and maps it. Returns that version, or None."""
+        version = rollback(self.index_path)
+        if version is not None: self.load_matrix()
+        return version
+
+    @property
+    def similarity(self):
+        index = self.index
+        return index.similarity if index is not None else None
 
     def get_scores(self, user_history_product_ids):
         """
         Takes a list of products a user has seen/ordered and returns a dictionary
         of similar products with their similarity scores.
         """
-        if self.similarity_matrix.empty or not user_history_product_ids:
+        index = self.index
+        if index is None or not user_history_product_ids:
             return {}
 
-        all_similar_items = pd.Series(dtype=float)
-        
-        # For each item in the user's history, find similar items and add up the scores
-        for product_id in user_history_product_ids:
-            if product_id in self.similarity_matrix.index:
-                similar = self.similarity_matrix[product_id].sort_values(ascending=False)
-                all_similar_items = all_similar_items.add(similar, fill_value=0)
+        # Gather the neighbour rows of every history item at once and sum scores per neighbour
+        history = np.asarray(user_history_product_ids, dtype=np.int64)
+        neighbour_rows, scores = index.gather(index.rows_for(history))
+        if not len(neighbour_rows):
+            return {}
+        rows, inverse = np.unique(neighbour_rows, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        product_ids = np.asarray(index.product_ids[rows])
 
         # Remove items the user has already seen
-        all_similar_items.drop(user_history_product_ids, inplace=True, errors='ignore')
-        
-        if all_similar_items.empty:
+        unseen = ~np.isin(product_ids, history)
+        product_ids, totals = product_ids[unseen], totals[unseen]
+
+        if not len(totals):
             return {}
-            
-        # Normalize the scores to be between 0 and 1
-        scores = all_similar_items / all_similar_items.max()
-        
-        return scores.nlargest(N_SIMILAR_ITEMS * 5).to_dict()
\ No newline at end of file
+
+        # Normalize the scores to be between 0 and 1 and keep the best ones
+        totals = totals / totals.max()
+        n = min(N_SIMILAR_ITEMS * 5, len(totals))
+        top = np.argpartition(-totals, n - 1)[:n]
+        top = top[np.argsort(-totals[top], kind='stable')]
+        return {int(pid): float(score) for pid, score in zip(product_ids[top], totals[top])}
+
+    def get_scores_batch(self, user_histories, n=N_SIMILAR_ITEMS * 5):
+        """
+        Batch version of get_scores for offline precomputation and replays.
+        Takes {user_id: [product_ids]} and returns {user_id: {product_id: score}}, scoring every
+        user at once as a sparse user x item history matrix times the item x item similarity matrix.
+        """
+        user_ids = list(user_histories)
+        results = {user_id: {} for user_id in user_ids}
+        index = self.index
+        if index is None or not user_ids:
+            return results
+
+        from scipy.sparse import csr_matrix
+        # 1. Build the sparse user x item history matrix in one pass over all histories
+        lengths = np.fromiter((len(user_histories[u] or []) for u in user_ids), dtype=np.int64, count=len(user_ids))
+        flat = np.fromiter((pid for u in user_ids for pid in (user_histories[u] or [])), dtype=np.int64, count=int(lengths.sum()))
+        owners = np.repeat(np.arange(len(user_ids)), lengths)
+        rows = index.rows_for(flat)
+        known = np.isin(flat, index.sorted_ids)
+        history = csr_matrix((np.ones(len(rows), dtype=np.float32), (owners[known], rows)), shape=(len(user_ids), len(index)))
+        history.sum_duplicates()
+        seen = history.copy()
+        seen.data[:] = 1.0
+
+        # 2. One sparse product scores everybody; items already in a history are masked out
+        scores = (history @ index.similarity).tocsr()
+        scores = (scores - scores.multiply(seen)).tocsr()
+        scores.eliminate_zeros()
+
+        # 3. Per-row top-n on dense chunks sized to keep the working set bounded
+        chunk_size = max(1, BATCH_DENSE_CELLS // max(1, len(index)))
+        product_ids = np.asarray(index.product_ids)
+        for start in range(0, len(user_ids), chunk_size):
+            block = scores[start:start + chunk_size].toarray()
+            k = min(n, block.shape[1])
+            if k == 0: break
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            # Normalize each row by its best score, as get_scores does
+            row_max = top_scores[:, :1]
+            normalized = np.divide(top_scores, row_max, out=np.zeros_like(top_scores), where=row_max > 0)
+            for offset in range(block.shape[0]):
+                hits = top_scores[offset] > 0
+                results[user_ids[start + offset]] = dict(zip(product_ids[top[offset][hits]].tolist(), normalized[offset][hits].tolist()))
+        return results
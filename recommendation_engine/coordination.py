@@ -0,0 +1,101 @@
+# recommendation_engine/coordination.py
+from datetime import datetime, timedelta, UTC
+import os
+import socket
+import threading
+from pymongo.errors import DuplicateKeyError
+try:
+    import fcntl
+except ImportError:   # Windows: no flock, every process builds for itself
+    fcntl = None
+
+LOCK_PATH = 'recommendation_engine/.model_builder.lock'
+LEASE_SECONDS = 1800   # A dead lease holder is replaced after this long; holders renew on every job run
+
+
+class LeaderElection:
+    """
+    Elects one model builder among the worker processes of a host (e.g. gunicorn workers).
+    The leader is whichever process holds an exclusive flock on LOCK_PATH. The OS releases the lock
+    when that process exits, so if a leader dies, the next worker that calls try_acquire() takes over.
+    The election is per host on purpose: followers memory-map the leader's artifacts from the local disk.
+    """
+    def __init__(self, path=LOCK_PATH):
+        self.path = path
+        self.file = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_leader(self):
+        return fcntl is None or (self.file is not None and self.pid == os.getpid())
+
+    def try_acquire(self):
+        """Returns True if this process is (now) the leader. Never blocks."""
+        if fcntl is None: return True
+        with self.lock:
+            if self.is_leader: return True
+            # A lock inherited through fork belongs to the parent; this process needs its own file description
+            self.file, self.pid = None, None
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            f = open(self.path, 'a+')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+            f.seek(0)
+            f.truncate()
+            f.write(f"{os.getpid()}\n")   # Informational only: which process builds
+            f.flush()
+            self.file, self.pid = f, os.getpid()
+            print(f"COORDINATION: Process {self.pid} is the model builder.")
+            return True
+
+    def release(self):
+        with self.lock:
+            if self.file is not None and self.pid == os.getpid():
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+                self.file.close()
+            self.file, self.pid = None, None
+
+
+class MongoLease:
+    """
+    Elects one process across every host for jobs that write shared MongoDB collections
+    (cluster counts, product popularity, the trending snapshot). The holder is recorded in a
+    model_state document with an expiry; it renews the lease each time it runs a job, and if it
+    dies, another process takes over once the lease has expired.
+    """
+    def __init__(self, db, name, seconds=LEASE_SECONDS):
+        self.db = db
+        self.id = f"lease:{name}"
+        self.seconds = seconds
+        self.holder = None
+
+    def _me(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @property
+    def is_leader(self):
+        return self.holder == self._me()
+
+    def try_acquire(self):
+        """Returns True if this process holds (and has just renewed) the lease. Never blocks."""
+        me, now = self._me(), datetime.now(UTC)
+        try:
+            self.db.model_state.find_one_and_update(
+                {'_id': self.id, '$or': [{'holder': me}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'holder': me, 'expires_at': now + timedelta(seconds=self.seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:   # The document exists and another process holds an unexpired lease
+            self.holder = None
+            return False
+        if self.holder != me: print(f"COORDINATION: Process {me} holds the {self.id} lease.")
+        self.holder = me
+        return True
+
+    def release(self):
+        if self.is_leader: self.db.model_state.delete_one({'_id': self.id, 'holder': self.holder})
+        self.holder = None
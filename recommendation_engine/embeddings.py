@@ -0,0 +1,175 @@
+# recommendation_engine/embeddings.py
+import json
+import math
+import os
+from datetime import datetime, UTC
+import numpy as np
+from .model_versions import staged_version, publish, resolve
+
+EMBEDDINGS_PATH = 'recommendation_engine/embeddings'
+FORMAT_VERSION = 1
+DIMENSIONS = 64           # Latent factors per item and user
+LSH_TABLES = 4            # Independent hash tables; more tables raise recall at the cost of more candidates
+TARGET_BUCKET_SIZE = 32   # Items per bucket the number of hash bits is chosen for
+BRUTE_FORCE_ITEMS = 4096  # Below this many items every query scores all items exactly
+
+ARRAY_FILES = ('product_ids', 'item_vectors', 'sorted_ids', 'sorted_rows', 'user_ids', 'user_vectors', 'user_order', 'planes', 'codes', 'code_order')
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def _hash(vectors, planes, bits):
+    """LSH codes of each vector, one int64 per table: the sign bits of its random projections."""
+    signs = (vectors @ planes > 0).reshape(len(vectors), -1, bits)
+    return (signs.astype(np.int64) << np.arange(bits, dtype=np.int64)).sum(axis=2)
+
+
+def build_embeddings(collection, dimensions=DIMENSIONS, seed=42):
+    """
+    Factorizes the sparse user x item interaction matrix with truncated SVD.
+    Returns (product_ids, item_vectors, user_ids, user_vectors) as unit-length float32 rows,
+    or None when there is nothing to build from.
+    """
+    # Only the builder needs scipy and scikit-learn; web workers just map the written arrays
+    from sklearn.decomposition import TruncatedSVD
+    from .similarity_builder import stream_interactions, build_interaction_matrix
+    matrix, product_ids, user_ids = build_interaction_matrix(stream_interactions(collection), with_users=True)
+    if matrix is None: return None
+    components = max(1, min(dimensions, min(matrix.shape) - 1))
+    svd = TruncatedSVD(n_components=components, algorithm='randomized', random_state=seed)
+    user_vectors = svd.fit_transform(matrix)                      # U x Sigma
+    item_vectors = svd.components_.T * svd.singular_values_       # V x Sigma
+    return product_ids, _normalize(item_vectors), user_ids, _normalize(user_vectors)
+
+
+def write_embeddings(product_ids, item_vectors, user_ids, user_vectors, path=EMBEDDINGS_PATH, seed=42, stats=None):
+    """Writes the vectors plus a random-projection LSH index over the items as plain .npy files, as a new published version."""
+    os.makedirs(path, exist_ok=True)
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    n_items, dims = item_vectors.shape
+    bits = int(min(24, max(1, math.log2(max(n_items, 2) / TARGET_BUCKET_SIZE))))
+    planes = np.random.default_rng(seed).standard_normal((dims, LSH_TABLES * bits)).astype(np.float32)
+    codes = _hash(item_vectors, planes, bits).T                   # tables x items
+    code_order = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+    sorted_rows = np.argsort(product_ids, kind='stable').astype(np.int64)
+    user_ids = np.asarray([str(u) for u in user_ids], dtype=str)
+    arrays = {
+        'product_ids': product_ids,
+        'item_vectors': item_vectors.astype(np.float32),
+        'sorted_ids': product_ids[sorted_rows],
+        'sorted_rows': sorted_rows,
+        'user_ids': user_ids,
+        'user_vectors': user_vectors.astype(np.float32),
+        'user_order': np.argsort(user_ids, kind='stable').astype(np.int64),
+        'planes': planes,
+        'codes': np.take_along_axis(codes, code_order, axis=1),
+        'code_order': code_order,
+    }
+    with staged_version(path) as (version, staging):
+        for name in ARRAY_FILES:
+            np.save(os.path.join(staging, f"{name}.npy"), arrays[name])
+
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'version': version,
+            'n_items': int(n_items),
+            'n_users': int(len(user_ids)),
+            'dimensions': int(dims),
+            'lsh_tables': LSH_TABLES,
+            'lsh_bits': bits,
+            'built_at': datetime.now(UTC).isoformat().replace('+00:00', 'Z'),
+        }
+        with open(os.path.join(staging, 'meta.json'), 'w') as f: json.dump(meta, f)
+        publish(path, version, staging, {**meta, **(stats or {})})
+    return meta
+
+
+class EmbeddingIndex:
+    """
+    Read-only, memory-mapped item and user embeddings with an approximate nearest-neighbour index.
+    A query hashes its vector into every table, probes its own bucket and the buckets one bit away,
+    and scores only those candidates exactly; memory stays linear in the number of items.
+    """
+    def __init__(self, path=EMBEDDINGS_PATH):
+        self.root = path
+        self.version, self.path = resolve(path)
+        with open(os.path.join(self.path, 'meta.json')) as f: self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embeddings format: {self.meta.get('format_version')}")
+        for name in ARRAY_FILES:
+            # Plain ndarray views of the mappings: same pages, without np.memmap's per-slice overhead
+            setattr(self, name, np.asarray(np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')))
+        self.bits = self.meta['lsh_bits']
+        # Probe masks: the query's own bucket plus every bucket at Hamming distance one
+        self.probes = np.concatenate([[0], np.int64(1) << np.arange(self.bits, dtype=np.int64)])
+
+    @classmethod
+    def open(cls, path=EMBEDDINGS_PATH):
+        """The index at path, or None if none has been built yet."""
+        try: return cls(path)
+        except FileNotFoundError: return None
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def _row(self, product_id):
+        pos = int(np.searchsorted(self.sorted_ids, product_id))
+        if pos < len(self.sorted_ids) and self.sorted_ids[pos] == product_id: return int(self.sorted_rows[pos])
+        return None
+
+    def _user_row(self, user_id):
+        user_id = str(user_id)
+        pos = int(np.searchsorted(self.user_ids, user_id, sorter=self.user_order))
+        if pos < len(self.user_order):
+            row = int(self.user_order[pos])
+            if self.user_ids[row] == user_id: return row
+        return None
+
+    def _candidates(self, vector):
+        if len(self) <= BRUTE_FORCE_ITEMS: return None
+        codes = _hash(vector[None, :], self.planes, self.bits)[0]
+        n_items = len(self)
+        starts, lengths = [], []
+        for table, code in enumerate(codes):
+            probes = code ^ self.probes
+            lo = np.searchsorted(self.codes[table], probes, side='left')
+            hi = np.searchsorted(self.codes[table], probes, side='right')
+            starts.append(lo + table * n_items)
+            lengths.append(hi - lo)
+        starts, lengths = np.concatenate(starts), np.concatenate(lengths)
+        total = int(lengths.sum())
+        if total == 0: return np.array([], dtype=np.int32)
+        # Every position of every probed bucket in the flattened tables x items order, without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        rows = np.sort(self.code_order.reshape(-1)[offsets])
+        return rows[np.concatenate(([True], rows[1:] != rows[:-1]))]   # Items hashed together in several tables
+
+    def _nearest(self, vector, n, exclude_row=None):
+        candidates = self._candidates(vector)
+        if candidates is None: scores = np.asarray(self.item_vectors @ vector)
+        else: scores = np.asarray(self.item_vectors[candidates] @ vector)
+        if exclude_row is not None:
+            if candidates is None: scores[exclude_row] = -np.inf
+            else: scores[candidates == exclude_row] = -np.inf
+        k = min(n, int(np.isfinite(scores).sum()))
+        if k <= 0: return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        rows = top if candidates is None else candidates[top]
+        return list(zip(self.product_ids[rows].tolist(), scores[top].tolist()))
+
+    def similar(self, product_id, n=10):
+        """[(product_id, cosine)] of the n items closest to product_id, or None if it is not indexed."""
+        row = self._row(product_id)
+        if row is None: return None
+        return self._nearest(np.asarray(self.item_vectors[row]), n, exclude_row=row)
+
+    def for_user(self, user_id, n=10):
+        """[(product_id, score)] of the n items closest to the user's vector, or None for unknown users."""
+        row = self._user_row(user_id)
+        if row is None: return None
+        return self._nearest(np.asarray(self.user_vectors[row]), n)
@@ -1,86 +1,185 @@
-from collections import defaultdict, Counter
-from datetime import datetime, timedelta, UTC
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+import time
 from .collaborative_filtering import CollaborativeFiltering
 from .personalization import Personalization
+from .cluster_popularity import ClusterPopularity
+from .trending import Trending
+from .seen_index import SeenIndex, DEFAULT_USER_ID
+from .catalog import ProductCatalog
+from .feed_store import FeedStore
+from .cluster_assignment import ClusterAssigner
+from .embeddings import EmbeddingIndex, EMBEDDINGS_PATH
+from .model_versions import rollback, resolve
+from .metrics import REGISTRY, stage, SECTION_RESULTS
+
+# Sections are finalized in this order; earlier sections win items that several sections propose
+SECTION_ORDER = ("collaborative", "self_feed", "trending")
+# Seconds each section may take before the last good (or an empty) result is served instead
+SECTION_BUDGETS = {"collaborative": 0.3, "self_feed": 0.3, "trending": 0.1}
+DEFAULT_SECTION_BUDGET = 0.3
+SECTION_WORKERS = 16
+LAST_GOOD_SIZE = 10000     # (user, section) results kept for degraded responses
+# Sources for the "For You" section: per-cluster popularity, or nearest items to the user's embedding
+FOR_YOU_SOURCES = ("cluster", "embedding")
+DEFAULT_FOR_YOU = "cluster"
+
+CLUSTER_LOOKUPS = REGISTRY.counter('feed_cluster_lookups_total', "Cluster lookups for the For You section by source (online, profile, none).", ('source',))
 
 class RecommendationEngine:
-    def __init__(self, db):
+    def __init__(self, db, section_budgets=SECTION_BUDGETS, for_you=DEFAULT_FOR_YOU):
         self.db = db
-        self.personalization_filter = Personalization(self.db)
-        # We no longer need the item-based collaborative filter for this section
-        # self.collaborative_filter = CollaborativeFiltering()
-
-    def get_recommendations_separated(self, list_size=10):
-        # --- Get User's Full Interaction History to Avoid Duplicates ---
-        historical_history = list(self.db.historical_events.find({'user_id': 'adhir_samal'}))
-        live_history = list(self.db.live_events.find())
-        all_seen_pids = set()
-        for event in historical_history + live_history:
-            try: all_seen_pids.add(int(event.get('detail', {}).get('order_number')))
-            except (ValueError, TypeError, AttributeError): continue
-            
-        # --- Helper to Finalize Lists ---
+        self.for_you = for_you
+        # None waits for every section (offline jobs); otherwise per-section overrides of SECTION_BUDGETS
+        self.section_budgets = None if section_budgets is None else {**SECTION_BUDGETS, **section_budgets}
+        self.executor = ThreadPoolExecutor(max_workers=SECTION_WORKERS, thread_name_prefix='feed-section')
+        self.last_good = OrderedDict()
+        self.lock = threading.Lock()
+        self.catalog = ProductCatalog(self.db)
+        self.cluster_popularity = ClusterPopularity(self.db)
+        self.trending = Trending(self.db)
+        self.seen_index = SeenIndex(self.db)
+        self.personalization_filter = Personalization(self.db, self.catalog, self.seen_index)
+        self.feed_store = FeedStore(self.db)
+        self.cluster_assigner = ClusterAssigner(self.db)
+        self.embeddings = EmbeddingIndex.open()
+        # Item neighbour model; no section scores with it, but it is kept mapped and hot-swapped with the embeddings
+        self.collaborative_filter = CollaborativeFiltering()
+
+    def record_event(self, event):
+        """Feeds a newly written event into the in-memory indexes."""
+        self.trending.record_event(event)
+        self.seen_index.record_event(event)
+        self.personalization_filter.record_event(event)
+        self.feed_store.mark_stale(event.get('user_id', DEFAULT_USER_ID))
+
+    def reload_embeddings(self):
+        try: version, _ = resolve(EMBEDDINGS_PATH)
+        except FileNotFoundError: return False   # Missing files keep the mapped version
+        if self.embeddings is not None and self.embeddings.version == version: return False
+        self.embeddings = EmbeddingIndex(EMBEDDINGS_PATH)
+        return True
+
+    def reload_models(self):
+        """
+        Maps newly published model versions; a no-op while the manifests are unchanged, so it is cheap to poll.
+        Requests in flight finish on the versions they started with. Returns True if anything was swapped.
+        """
+        reloaded = self.collaborative_filter.load_matrix()
+        return self.reload_embeddings() or reloaded
+
+    def rollback_models(self):
+        """Points each model back at its previous published version and maps it. Returns {model: version or None}."""
+        rolled_back = {'item_similarity': self.collaborative_filter.rollback(), 'embeddings': rollback(EMBEDDINGS_PATH)}
+        self.reload_embeddings()
+        return rolled_back
+
+    def model_versions(self):
+        embeddings = self.embeddings
+        return {'item_similarity': self.collaborative_filter.version, 'embeddings': embeddings.version if embeddings else None}
+
+    def get_feed(self, user_id=DEFAULT_USER_ID, list_size=10, for_you=None):
+        """Serves the precomputed feed when it is fresh and computes it live otherwise."""
+        # Precomputed feeds use the default "For You" source; any other source is computed live
+        if for_you in (None, self.for_you):
+            with stage('feed', 'store_lookup'): feed = self.feed_store.get(user_id)
+            # Staleness marks are per process, so items the user has interacted with since the precompute are dropped here
+            if feed is not None: return {section: self.seen_index.filter_unseen(user_id, pids) for section, pids in feed.items()}
+        return self.get_recommendations_separated(user_id, list_size, for_you)
+
+    def _collaborative_candidates(self, user_id, list_size):
+        # 1. Get the current user's cluster ID, assigned online for users newer than the last clustering run
+        cluster_id = self.cluster_assigner.cluster_for(user_id)
+        if cluster_id is None:
+            user_profile = self.db.users.find_one({'user_id': user_id}, {'_id': 0, 'cluster_id': 1})
+            if not user_profile or 'cluster_id' not in user_profile:
+                CLUSTER_LOOKUPS.inc(source='none')
+                return []
+            cluster_id = user_profile['cluster_id']
+            CLUSTER_LOOKUPS.inc(source='profile')
+        else:
+            CLUSTER_LOOKUPS.inc(source='online')
+
+        # 2. Read the cluster's precomputed popularity ranking (see cluster_popularity.py)
+        return self.cluster_popularity.get_ranked_products(cluster_id)
+
+    def _embedding_candidates(self, user_id, list_size):
+        # Nearest items to the user's embedding; users the last factorization has not seen fall back to their cluster
+        embeddings = self.embeddings
+        if embeddings is None: return self._collaborative_candidates(user_id, list_size)
+        n = 4 * list_size
+        while True:
+            nearest = embeddings.for_user(user_id, n)
+            if nearest is None: return self._collaborative_candidates(user_id, list_size)
+            unseen = self.seen_index.filter_unseen(user_id, [pid for pid, _ in nearest])
+            # Widen the search only while seen items crowd out the list and more items exist
+            if len(unseen) >= list_size or len(nearest) < n or n >= len(embeddings): return unseen
+            n *= 4
+
+    def _self_feed_candidates(self, user_id, list_size):
+        # Already seen-filtered and ranked; the collaborative section can claim at most list_size of them
+        return self.personalization_filter.get_category_recommendations(user_id, 2 * list_size)
+
+    def _trending_candidates(self, user_id, list_size):
+        # Constant-time read of the streaming, time-decayed counters (see trending.py)
+        return self.trending.get_trending(20)
+
+    def _timed_section(self, section, source, user_id, list_size):
+        # Runs on the section pool, so the histogram sees the section's own time and not the wait
+        with stage('feed_section', section): return source(user_id, list_size)
+
+    def _fallback(self, user_id, section):
+        with self.lock: return self.last_good.get((user_id, section), [])
+
+    def _remember(self, user_id, section, candidates):
+        with self.lock:
+            self.last_good[(user_id, section)] = candidates
+            self.last_good.move_to_end((user_id, section))
+            while len(self.last_good) > LAST_GOOD_SIZE: self.last_good.popitem(last=False)
+
+    def get_recommendations_separated(self, user_id=DEFAULT_USER_ID, list_size=10, for_you=None, degraded=None):
+        """All three sections; sections that timed out or failed are added to the degraded set if one is passed."""
+        with stage('feed', 'total'): return self._recommendations_separated(user_id, list_size, for_you or self.for_you, degraded)
+
+    def _recommendations_separated(self, user_id, list_size, for_you, degraded):
+        # --- Gather candidates for all sections concurrently, each within its own latency budget ---
+        for_you_source = self._embedding_candidates if for_you == "embedding" else self._collaborative_candidates
+        sources = {
+            "collaborative": for_you_source,                    # "For You"
+            "self_feed": self._self_feed_candidates,            # "Based on Your Recent Activity"
+            "trending": self._trending_candidates,              # "Trending Now"
+        }
+        started = time.monotonic()
+        futures = {section: self.executor.submit(self._timed_section, section, source, user_id, list_size) for section, source in sources.items()}
+        candidates = {}
+        for section, future in futures.items():
+            budget = None if self.section_budgets is None else self.section_budgets.get(section, DEFAULT_SECTION_BUDGET)
+            try:
+                candidates[section] = future.result(timeout=None if budget is None else max(0.0, started + budget - time.monotonic()))
+                self._remember(user_id, section, candidates[section])
+                SECTION_RESULTS.inc(section=section, outcome='ok')
+            except TimeoutError:
+                SECTION_RESULTS.inc(section=section, outcome='timeout')
+                print(f"ENGINE_TIMEOUT ({section}): exceeded {budget:.3f}s budget, degrading to the last good result.")
+                candidates[section] = self._fallback(user_id, section)
+                if degraded is not None: degraded.add(section)
+            except Exception as e:
+                SECTION_RESULTS.inc(section=section, outcome='error')
+                print(f"ENGINE_ERROR ({section}): {e}")
+                candidates[section] = self._fallback(user_id, section)
+                if degraded is not None: degraded.add(section)
+
+        # --- Finalize lists in a fixed section order so de-duplication is deterministic ---
+        # Seen items come from the in-memory SeenIndex; picked tracks items already placed in an earlier section
+        picked = set()
         def finalize_list(pids):
             final_list = []
-            for pid in pids:
-                if pid not in all_seen_pids:
+            for pid in self.seen_index.filter_unseen(user_id, pids):
+                if pid not in picked:
                     final_list.append(pid)
-                    all_seen_pids.add(pid)
+                    picked.add(pid)
                 if len(final_list) >= list_size: break
             return final_list
 
-        # --- 💡 NEW LOGIC for "For You" (Collaborative) Recommendations ---
-        collaborative_recs = []
-        try:
-            # 1. Get the current user's cluster ID
-            user_profile = self.db.users.find_one({'user_id': 'adhir_samal'})
-            if user_profile and 'cluster_id' in user_profile:
-                cluster_id = user_profile['cluster_id']
-                print(f"User adhir_samal belongs to cluster {cluster_id}.")
-
-                # 2. Find other users in the same cluster
-                other_users_in_cluster = list(self.db.users.find(
-                    {'cluster_id': cluster_id, 'user_id': {'$ne': 'adhir_samal'}},
-                    {'user_id': 1}
-                ))
-                other_user_ids = [u['user_id'] for u in other_users_in_cluster]
-
-                if other_user_ids:
-                    # 3. Find all historical items those users interacted with
-                    cluster_events = list(self.db.historical_events.find({'user_id': {'$in': other_user_ids}}))
-                    
-                    # 4. Rank those items by popularity
-                    pids_to_count = [int(e['detail']['order_number']) for e in cluster_events if e.get('detail', {}).get('order_number')]
-                    if pids_to_count:
-                        cluster_item_counter = Counter(pids_to_count)
-                        collab_pids = [pid for pid, count in cluster_item_counter.most_common()]
-                        collaborative_recs = finalize_list(collab_pids)
-        except Exception as e:
-            print(f"ENGINE_ERROR (Collaborative-Clustering): {e}")
-
-        # --- "Based on Your Recent Activity" Recommendations (No Change) ---
-        self_feed_recs = []
-        try:
-            self_feed_pids = self.personalization_filter.get_category_recommendations()
-            self_feed_recs = finalize_list(self_feed_pids)
-        except Exception as e:
-            print(f"ENGINE_ERROR (Self Feed): {e}")
-            
-        # --- "Trending Now" Recommendations (No Change) ---
-        trending_recs = []
-        try:
-            event_source = list(self.db.live_events.find({"serverTimestamp": {"$gte": datetime.now(UTC) - timedelta(days=2)}}))
-            if not event_source: event_source = list(self.db.historical_events.find())
-            pids_to_count = [int(e['detail']['order_number']) for e in event_source if e.get('detail', {}).get('order_number')]
-            if pids_to_count:
-                trending_pids_counter = Counter(pids_to_count)
-                trending_pids = [pid for pid, count in trending_pids_counter.most_common(20)]
-            trending_recs = finalize_list(trending_pids)
-        except Exception as e:
-            print(f"ENGINE_ERROR (Trending): {e}")
-
-        return {
-            "collaborative": collaborative_recs,
-            "self_feed": self_feed_recs,
-            "trending": trending_recs
-        }
\ No newline at end of file
+        with stage('feed', 'finalize'): return {section: finalize_list(candidates[section]) for section in SECTION_ORDER}
@@ -0,0 +1,110 @@
+# recommendation_engine/feed_cache.py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from .metrics import REGISTRY
+
+FEED_CACHE_SIZE = 50000        # Cached responses kept (least recently used are dropped)
+FEED_CACHE_TTL = 60.0          # Seconds a response is served as fresh
+FEED_CACHE_MAX_STALE = 600.0   # Seconds past its TTL a response may still be served while it is refreshed
+REFRESH_WORKERS = 4
+
+LOOKUPS = REGISTRY.counter('feed_cache_lookups_total', "Feed cache lookups by result (hit, stale, miss).", ('result',))
+INVALIDATIONS = REGISTRY.counter('feed_cache_invalidations_total', "Feed cache invalidations by reason.", ('reason',))
+
+
+class FeedCache:
+    """
+    Bounded LRU of serialized feed responses, keyed by (user_id, variant).
+    - An event from a user drops that user's entries at once, so their next feed reflects it.
+    - Publishing a new model, trending snapshot or ranking bumps the generation. Older entries are then
+      treated like expired ones rather than dropped, so a publish does not make every user recompute at once.
+    - An expired entry is served stale while one background refresh per key recomputes it, for up to
+      max_stale seconds; after that the request computes the response itself.
+    """
+    def __init__(self, size=FEED_CACHE_SIZE, ttl=FEED_CACHE_TTL, max_stale=FEED_CACHE_MAX_STALE):
+        self.size, self.ttl, self.max_stale = size, ttl, max_stale
+        self.entries = OrderedDict()   # (user_id, variant) -> (body, stored_at, generation)
+        self.user_keys = {}            # user_id -> variants cached for that user
+        self.epochs = {}               # user_id -> invalidation count, so a compute racing an event is not stored
+        self.epoch_resets = 0
+        self.generation = 0
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='feed-cache-refresh')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _token(self, user_id):
+        return self.epoch_resets, self.epochs.get(user_id, 0), self.generation
+
+    def get(self, user_id, variant, compute):
+        """Returns (body, result) where result is 'hit', 'stale' or 'miss'; compute() builds the body on a miss."""
+        key = (user_id, variant)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                body, stored_at, generation = entry
+                age = now - stored_at
+                if age <= self.ttl and generation == self.generation:
+                    LOOKUPS.inc(result='hit')
+                    return body, 'hit'
+                if age <= self.ttl + self.max_stale:
+                    if key not in self.refreshing:
+                        self.refreshing.add(key)
+                        self.executor.submit(self._refresh, key, compute, self._token(user_id))
+                    LOOKUPS.inc(result='stale')
+                    return body, 'stale'
+            token = self._token(user_id)
+        LOOKUPS.inc(result='miss')
+        body = compute()
+        self._store(key, body, token)
+        return body, 'miss'
+
+    def _refresh(self, key, compute, token):
+        try:
+            self._store(key, compute(), token)
+        except Exception as e:
+            print(f"FEED_CACHE: Background refresh for {key[0]} failed: {e}")
+        finally:
+            with self.lock: self.refreshing.discard(key)
+
+    def _store(self, key, body, token):
+        user_id = key[0]
+        with self.lock:
+            # The user logged an event while this response was being computed: it may already be outdated
+            if token[:2] != self._token(user_id)[:2]: return
+            # Stamped with the generation it was computed under, so a publish during the compute still refreshes it
+            self.entries[key] = (body, time.monotonic(), token[2])
+            self.entries.move_to_end(key)
+            self.user_keys.setdefault(user_id, set()).add(key[1])
+            while len(self.entries) > self.size:
+                (old_user, old_variant), _ = self.entries.popitem(last=False)
+                variants = self.user_keys.get(old_user)
+                if variants is not None:
+                    variants.discard(old_variant)
+                    if not variants: del self.user_keys[old_user]
+
+    def invalidate_user(self, user_id):
+        """Drops every cached response of the user; called when they log an event."""
+        with self.lock:
+            for variant in self.user_keys.pop(user_id, ()):
+                self.entries.pop((user_id, variant), None)
+            self.epochs[user_id] = self.epochs.get(user_id, 0) + 1
+            if len(self.epochs) > self.size:
+                # Forgetting epochs is safe only if computes that started before are not stored either
+                self.epochs.clear()
+                self.epoch_resets += 1
+        INVALIDATIONS.inc(reason='user_event')
+
+    def bump_generation(self, reason):
+        """Marks every cached response as out of date, e.g. after a new model version is mapped."""
+        with self.lock: self.generation += 1
+        INVALIDATIONS.inc(reason=reason)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
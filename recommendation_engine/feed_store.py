@@ -0,0 +1,45 @@
+# recommendation_engine/feed_store.py
+from datetime import datetime, timedelta, UTC
+import threading
+from pymongo import ReplaceOne
+
+FEED_MAX_AGE = timedelta(hours=6)   # Precomputed feeds older than this are recomputed live
+SECTIONS = ('collaborative', 'self_feed', 'trending')
+
+
+class FeedStore:
+    """
+    Materialized per-user feeds in db.feeds, written by scripts/precompute_feeds.py.
+    A feed is served only while it is fresh: younger than FEED_MAX_AGE and not invalidated
+    by an event the user logged in this process after it was computed.
+    """
+    def __init__(self, db, max_age=FEED_MAX_AGE):
+        self.db = db
+        self.max_age = max_age
+        self.touched = {}     # user_id -> time of the user's latest event seen by this process
+        self.lock = threading.Lock()
+
+    def mark_stale(self, user_id):
+        with self.lock: self.touched[user_id] = datetime.now(UTC)
+
+    def get(self, user_id):
+        """Returns the user's precomputed sections, or None when missing or stale."""
+        doc = self.db.feeds.find_one({'user_id': user_id}, {'_id': 0})
+        if not doc: return None
+        computed_at = doc['computed_at']
+        if computed_at.tzinfo is None: computed_at = computed_at.replace(tzinfo=UTC)
+        if computed_at < datetime.now(UTC) - self.max_age: return None
+        touched = self.touched.get(user_id)
+        if touched and touched >= computed_at: return None
+        return {section: doc.get(section, []) for section in SECTIONS}
+
+    @staticmethod
+    def write(db, feeds, computed_at=None):
+        """Upserts {user_id: sections} into db.feeds in one unordered bulk write."""
+        computed_at = computed_at or datetime.now(UTC)
+        ops = [
+            ReplaceOne({'user_id': user_id}, {'user_id': user_id, 'computed_at': computed_at, **sections}, upsert=True)
+            for user_id, sections in feeds.items()
+        ]
+        if ops: db.feeds.bulk_write(ops, ordered=False)
+        return len(ops)
@@ -0,0 +1,46 @@
+# recommendation_engine/indexes.py
+from pymongo import ASCENDING, DESCENDING
+
+# Indexes behind the engine's queries, per collection: (keys, options)
+INDEXES = {
+    'users': [
+        ([('user_id', ASCENDING)], {}),                                  # profile lookups, $lookup from events
+        ([('cluster_id', ASCENDING)], {}),
+    ],
+    'live_events': [
+        ([('user_id', ASCENDING), ('serverTimestamp', DESCENDING)], {}), # a user's events, newest first
+        ([('serverTimestamp', DESCENDING)], {}),                          # trending warm-up window
+    ],
+    'historical_events': [
+        ([('user_id', ASCENDING), ('detail.category', ASCENDING)], {}),   # clustering and seen-item scans
+        ([('detail.order_number', ASCENDING)], {}),
+    ],
+    'products': [
+        ([('product_id', ASCENDING)], {'unique': True}),
+        ([('category', ASCENDING), ('product_id', ASCENDING)], {}),
+    ],
+    'cluster_product_counts': [
+        ([('cluster_id', ASCENDING), ('count', DESCENDING)], {}),
+        ([('cluster_id', ASCENDING), ('product_id', ASCENDING)], {'unique': True}),
+    ],
+    'cluster_rankings': [
+        ([('cluster_id', ASCENDING)], {'unique': True}),
+    ],
+    'feeds': [
+        ([('user_id', ASCENDING)], {'unique': True}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Creates any missing index in INDEXES. Existing indexes are left alone, so this is cheap to repeat."""
+    created = 0
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+                created += 1
+            except Exception as e:
+                print(f"INDEXES: Could not create {collection} {keys}: {e}")
+    print(f"INDEXES: Ensured {created} indexes.")
+    return created
@@ -0,0 +1,94 @@
+# recommendation_engine/ingestion.py
+import queue
+import threading
+import time
+from bson import ObjectId
+
+MAX_QUEUE_SIZE = 10000     # Events buffered in memory before the endpoints start pushing back
+BATCH_SIZE = 500           # Events per insert_many
+FLUSH_INTERVAL = 0.5       # Seconds a partial batch may wait before it is written
+ENQUEUE_TIMEOUT = 0.05     # Seconds a request waits for room in a full queue before the event is shed
+
+_STOP = object()
+
+
+class EventIngestor:
+    """
+    Write-behind buffer for event documents. Requests enqueue and return immediately; a background
+    thread groups events into unordered insert_many batches, flushing by size or by time.
+    When the queue is full, submit() applies brief backpressure and then sheds the event.
+    Work that needs a database round-trip per event goes in on_written callbacks, which the writer
+    thread calls with each batch once it is in the collection, instead of on the request path.
+    """
+    def __init__(self, collection, max_queue_size=MAX_QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, enqueue_timeout=ENQUEUE_TIMEOUT, on_written=()):
+        self.collection = collection
+        self.on_written = list(on_written)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name='event-ingestor', daemon=True)
+        self.thread.start()
+
+    def submit(self, event):
+        """Queues an event for writing. Returns False if it was shed because the queue stayed full."""
+        # The _id is assigned now rather than at insert, so in-memory indexes can tell this event apart before it is written
+        event.setdefault('_id', ObjectId())
+        try:
+            self.queue.put(event, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try: first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty: continue
+            if first is _STOP: break
+            batch.append(first)
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try: event = self.queue.get(timeout=remaining)
+                except queue.Empty: break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            self._write(batch)
+
+        # Drain whatever is still queued so shutdown loses nothing
+        batch = []
+        while True:
+            try: event = self.queue.get_nowait()
+            except queue.Empty: break
+            if event is not _STOP: batch.append(event)
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+
+    def _write(self, batch):
+        if not batch: return
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"INGESTION_ERROR: Failed to write {len(batch)} events: {e}")
+            return
+        for callback in self.on_written:
+            try: callback(batch)
+            except Exception as e: print(f"INGESTION_ERROR: on_written callback failed: {e}")
+
+    def close(self, timeout=10):
+        """Flushes everything still buffered and stops the writer thread."""
+        if not self.thread.is_alive(): return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
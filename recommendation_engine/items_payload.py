@@ -0,0 +1,92 @@
+# recommendation_engine/items_payload.py
+from bisect import bisect_right
+from collections import namedtuple
+import gzip
+import hashlib
+import json
+import threading
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# One encoded catalog reload. Published by a single assignment, so a request that reads it once
+# never mixes the body of one version with the ETag or pages of another.
+Snapshot = namedtuple('Snapshot', 'version etag plain compressed pages')
+GZIP_ETAG_SUFFIX = '-gz'   # The gzip bytes differ from the plain ones, so they get their own strong ETag
+
+
+def format_item(product):
+    return {'brand': product.get('brand', 'No Brand'), 'order_number': product.get('product_id', 0), 'product': product.get('product_name', 'No Name')}
+
+
+class ItemsPayload:
+    """
+    Pre-encoded /api/items responses. The category-grouped catalog is serialized once per catalog
+    reload into plain and gzip bytes with an ETag, and per-category id lists are kept sorted so
+    pages can be served with a product_id cursor without rebuilding anything per request.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        # pages: category -> (sorted product ids, products in the same order)
+        self.snapshot = Snapshot(version=object(), etag=None, plain=b'', compressed=b'', pages={})
+
+    def _chunks(self, grouped):
+        """Yields the grouped JSON document piece by piece, one item at a time."""
+        yield b'{'
+        for i, category in enumerate(sorted(grouped)):
+            yield (b',' if i else b'') + json.dumps(category).encode() + b':['
+            for j, product in enumerate(grouped[category]):
+                yield (b',' if j else b'') + json.dumps(format_item(product), sort_keys=True).encode()
+            yield b']'
+        yield b'}\n'
+
+    def refresh(self):
+        """Re-encodes the payload if the catalog was reloaded since the last build. Returns the current snapshot."""
+        snapshot = self.snapshot
+        if snapshot.version == self.catalog.reloads: return snapshot
+        with self.lock:
+            version = self.catalog.reloads
+            if self.snapshot.version == version: return self.snapshot
+            grouped = {}
+            for product in self.catalog.products.values():
+                grouped.setdefault(product.get('category', 'Uncategorized'), []).append(product)
+
+            digest, parts = hashlib.sha1(), []
+            compressor_parts = []
+            with gzip.GzipFile(fileobj=_Sink(compressor_parts), mode='wb', mtime=0) as compressor:
+                for chunk in self._chunks(grouped):
+                    digest.update(chunk)
+                    parts.append(chunk)
+                    compressor.write(chunk)
+
+            pages = {}
+            for category, products in grouped.items():
+                products = sorted(products, key=lambda p: p.get('product_id', 0))
+                pages[category] = ([p.get('product_id', 0) for p in products], products)
+
+            self.snapshot = Snapshot(version, digest.hexdigest(), b''.join(parts), b''.join(compressor_parts), pages)
+            return self.snapshot
+
+    def page(self, category, cursor=None, limit=DEFAULT_PAGE_SIZE, snapshot=None):
+        """One page of a category, ordered by product id, starting after the cursor product id."""
+        ids, products = (snapshot or self.snapshot).pages.get(category, ([], []))
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        start = bisect_right(ids, cursor) if cursor is not None else 0
+        chunk = products[start:start + limit]
+        next_cursor = ids[start + limit - 1] if start + limit < len(ids) else None
+        return {'category': category, 'items': [format_item(p) for p in chunk], 'next_cursor': next_cursor}
+
+
+class _Sink:
+    """Minimal file object collecting the compressor output."""
+    def __init__(self, parts):
+        self.parts = parts
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
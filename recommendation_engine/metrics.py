@@ -0,0 +1,212 @@
+# recommendation_engine/metrics.py
+from bisect import bisect_left
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+import sys
+import threading
+import time
+from pymongo import monitoring
+
+# Upper bounds in seconds; an observation lands in the first bucket it fits (plus +Inf)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+PROFILER_INTERVAL = 0.005   # Seconds between stack samples
+PROFILER_INTERVAL_RANGE = (0.001, 1.0)   # Shorter intervals turn the sampler into a busy loop holding the GIL
+PROFILER_MAX_DEPTH = 64
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names: return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock: self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock: values = list(self.values.items())
+        lines += [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}   # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None: series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock: series = [(key, list(values)) for key, values in self.series.items()]
+        names = self.labels + ("le",)
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {values[-1]}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+class CallbackGauge:
+    """A value read from a function at scrape time, e.g. a queue depth kept by another object."""
+    def __init__(self, name, help_text, func, kind='gauge'):
+        self.name, self.help, self.func, self.kind = name, help_text, func, kind
+
+    def render(self):
+        try: value = self.func()
+        except Exception: return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock: return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name, help_text, func, kind='gauge'):
+        with self.lock: self.metrics[name] = CallbackGauge(name, help_text, func, kind)   # Latest registration wins
+
+    def render(self):
+        """The Prometheus text exposition format (version 0.0.4)."""
+        with self.lock: metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics: lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Shared metrics, defined here so every module records into the same series
+STAGE_SECONDS = REGISTRY.histogram('feed_stage_duration_seconds', "Duration of internal processing stages.", ('component', 'stage'))
+SECTION_RESULTS = REGISTRY.counter('feed_section_results_total', "Feed section evaluations by outcome.", ('section', 'outcome'))
+MONGO_SECONDS = REGISTRY.histogram('feed_mongo_command_duration_seconds', "MongoDB command latency.", ('collection', 'command'))
+MONGO_FAILURES = REGISTRY.counter('feed_mongo_command_failures_total', "Failed MongoDB commands.", ('collection', 'command'))
+HTTP_SECONDS = REGISTRY.histogram('feed_http_request_duration_seconds', "HTTP request latency by route.", ('route', 'method', 'status'))
+
+
+def stage(component, name):
+    """Context manager timing one stage of a component into feed_stage_duration_seconds."""
+    return STAGE_SECONDS.time(component=component, stage=name)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener that records per-collection command latency. Register it with
+    pymongo.monitoring.register() before any MongoClient is created.
+    """
+    def __init__(self):
+        self.pending = {}   # (connection, request id) -> collection name
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str): collection = ""   # e.g. ping, or getMore's cursor id
+        if event.command_name == 'getMore': collection = event.command.get('collection', "")
+        with self.lock: self.pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event):
+        with self.lock: return self.pending.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, collection=self._finish(event), command=event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        MONGO_FAILURES.inc(collection=collection, command=event.command_name)
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler: a background thread samples every other thread's stack at a
+    fixed interval and counts identical stacks. report() returns them in the collapsed
+    "frame;frame;frame count" format that flame graph tools read.
+    """
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.stacks = _StackCounter()
+        self.samples = 0
+        self.thread = None
+        self.running = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.running.is_set()
+
+    def start(self, interval=None):
+        with self.lock:
+            if self.enabled: return
+            if interval: self.interval = interval
+            self.stacks, self.samples = _StackCounter(), 0
+            self.running.set()
+            self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.running.clear()
+            if self.thread: self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        try:
+            while self.running.is_set():
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own: continue
+                    stack = []
+                    while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            self.running.clear()   # A sampler that died must not keep reporting itself as enabled
+
+    def report(self):
+        stacks = list(self.stacks.items())
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(stacks, key=lambda kv: -kv[1])) + "\n"
+
+
+PROFILER = SamplingProfiler()
@@ -0,0 +1,65 @@
+# recommendation_engine/model_builder.py
+"""
+The hourly model rebuild, meant to run in its own process so the build's CPU time and GIL holds
+never stall the web workers:
+
+    python -m recommendation_engine.model_builder
+
+Each artifact is written as a new version and published atomically (see model_versions.py);
+serving processes pick it up with RecommendationEngine.reload_models().
+"""
+import os
+import sys
+import time
+from pymongo import MongoClient
+
+from .neighbour_index import write_neighbour_index, INDEX_PATH
+from .embeddings import build_embeddings, write_embeddings, EMBEDDINGS_PATH
+
+# Exit codes of the builder process
+BUILT, SKIPPED, FAILED = 0, 3, 1
+
+
+def build_models(db, index_path=INDEX_PATH, embeddings_path=EMBEDDINGS_PATH):
+    """
+    Builds and publishes the item neighbour index and the embeddings from db.historical_events.
+    Returns {stage: seconds} for the build, or None when there are no historical events.
+    """
+    # scipy loads here rather than at import, so serving processes can import the exit codes for free
+    from .similarity_builder import build_item_similarity
+    seconds = {}
+    started = time.perf_counter()
+    product_ids, neighbours = build_item_similarity(db.historical_events)
+    seconds['similarity'] = time.perf_counter() - started
+    if product_ids is None: return None
+
+    started = time.perf_counter()
+    write_neighbour_index(product_ids, neighbours, index_path, stats={'build_seconds': round(seconds['similarity'], 3)})
+    seconds['write'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    built = build_embeddings(db.historical_events)
+    if built is not None:
+        write_embeddings(*built, path=embeddings_path, stats={'build_seconds': round(time.perf_counter() - started, 3)})
+    seconds['embeddings'] = time.perf_counter() - started
+    return seconds
+
+
+def main():
+    # The serving process passes its own connection settings, so a builder always reads the database it serves from
+    from config import MONGO_URI, DATABASE_NAME
+    uri = os.environ.get('FEED_MONGO_URI', MONGO_URI)
+    database = os.environ.get('FEED_DATABASE_NAME', DATABASE_NAME)
+    try:
+        seconds = build_models(MongoClient(uri)[database])
+    except Exception as e:
+        print(f"MODEL_BUILD: Build failed: {e}")
+        return FAILED
+    if seconds is None:
+        print("MODEL_BUILD: No historical events found to build model. Skipping.")
+        return SKIPPED
+    print(f"MODEL_BUILD: Built in {sum(seconds.values()):.1f}s ({', '.join(f'{name} {s:.1f}s' for name, s in seconds.items())}).")
+    return BUILT
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# recommendation_engine/model_versions.py
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, UTC
+
+MANIFEST_FILE = 'manifest.json'
+KEEP_VERSIONS = 3   # Published versions kept on disk per model, so a bad build can be rolled back
+
+
+def read_manifest(root):
+    """The model root's manifest, or None if nothing has been published there yet."""
+    try:
+        with open(os.path.join(root, MANIFEST_FILE)) as f: return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(root, manifest):
+    # Readers only ever see the old or the new manifest, never a partial one
+    tmp_path = os.path.join(root, f".{MANIFEST_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, MANIFEST_FILE))
+
+
+@contextmanager
+def staged_version(root):
+    """
+    Yields (version, path) of an empty directory for a new version. Nothing reads it until publish();
+    if the block raises, the partial version is removed.
+    """
+    version = datetime.now(UTC).strftime('%Y%m%dT%H%M%S%fZ')
+    path = os.path.join(root, f".staging-{version}-{os.getpid()}")
+    os.makedirs(path)
+    try: yield version, path
+    except BaseException:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+
+def publish(root, version, staging, stats=None):
+    """
+    Renames a fully written staging directory to root/<version> and points the manifest at it.
+    Both steps are atomic renames, so a reader resolves either the previous version or this one.
+    """
+    os.replace(staging, os.path.join(root, version))
+    manifest = read_manifest(root) or {'current': None, 'versions': []}
+    manifest['versions'].append({'version': version, **(stats or {})})
+    manifest['previous'], manifest['current'] = manifest.get('current'), version
+    # Old versions are dropped from disk too; processes still mapping them keep their pages until they reload
+    while len(manifest['versions']) > KEEP_VERSIONS:
+        dropped = manifest['versions'].pop(0)['version']
+        shutil.rmtree(os.path.join(root, dropped), ignore_errors=True)
+    _write_manifest(root, manifest)
+    return manifest
+
+
+def current_path(root):
+    """Directory of the current version, the pre-versioning flat layout, or None if no model exists."""
+    manifest = read_manifest(root)
+    if manifest and manifest.get('current'): return os.path.join(root, manifest['current'])
+    if os.path.exists(os.path.join(root, 'meta.json')): return root
+    return None
+
+
+def resolve(root):
+    """(version, path) of the model to open. Raises FileNotFoundError when none has been built."""
+    path = current_path(root)
+    if path is None: raise FileNotFoundError(f"No model published under {root}")
+    return (os.path.basename(path) if path != root else 'legacy'), path
+
+
+def rollback(root):
+    """Points the manifest back at the newest version older than the current one. Returns it, or None."""
+    manifest = read_manifest(root)
+    if not manifest: return None
+    versions = [entry['version'] for entry in manifest['versions']]
+    current = manifest.get('current')
+    older = versions[:versions.index(current)] if current in versions else []
+    for version in reversed(older):
+        if os.path.isdir(os.path.join(root, version)):
+            manifest['previous'], manifest['current'] = current, version
+            _write_manifest(root, manifest)
+            return version
+    return None
@@ -0,0 +1,91 @@
+# recommendation_engine/neighbour_index.py
+import json
+import os
+from datetime import datetime, UTC
+import numpy as np
+from .model_versions import staged_version, publish, resolve
+
+INDEX_PATH = 'recommendation_engine/item_similarity'
+FORMAT_VERSION = 1
+
+# Every array is a plain .npy file so it can be memory-mapped read-only and shared between workers
+ARRAY_FILES = ('product_ids', 'indptr', 'indices', 'scores', 'sorted_ids', 'sorted_rows')
+
+
+def write_neighbour_index(product_ids, neighbours, path=INDEX_PATH, stats=None):
+    """
+    Writes a top-K neighbour model as CSR arrays plus a sorted id -> row lookup.
+    product_ids[row] is the product behind each row/column of the neighbours CSR matrix.
+    The arrays go to a new version directory that is published once complete (see model_versions.py).
+    """
+    os.makedirs(path, exist_ok=True)
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    sorted_rows = np.argsort(product_ids, kind='stable').astype(np.int64)
+    arrays = {
+        'product_ids': product_ids,
+        'indptr': neighbours.indptr.astype(np.int64),
+        'indices': neighbours.indices.astype(np.int32),
+        'scores': neighbours.data.astype(np.float32),
+        'sorted_ids': product_ids[sorted_rows],
+        'sorted_rows': sorted_rows,
+    }
+    with staged_version(path) as (version, staging):
+        for name in ARRAY_FILES:
+            np.save(os.path.join(staging, f"{name}.npy"), arrays[name])
+
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'version': version,
+            'n_items': int(len(product_ids)),
+            'nnz': int(neighbours.nnz),
+            'built_at': datetime.now(UTC).isoformat().replace('+00:00', 'Z'),
+        }
+        with open(os.path.join(staging, 'meta.json'), 'w') as f: json.dump(meta, f)
+        publish(path, version, staging, {**meta, **(stats or {})})
+    return meta
+
+
+class NeighbourIndex:
+    """
+    Read-only view of the current version of an on-disk neighbour model. Arrays are memory-mapped,
+    so opening an index only maps the files and the OS page cache is shared by every process that opens it.
+    """
+    def __init__(self, path=INDEX_PATH):
+        self.root = path
+        self.version, self.path = resolve(path)
+        self._similarity = None
+        with open(os.path.join(self.path, 'meta.json')) as f: self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported neighbour index format: {self.meta.get('format_version')}")
+        for name in ARRAY_FILES:
+            setattr(self, name, np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    @property
+    def similarity(self):
+        """Sparse item x item view over the mapped arrays, used by the batch scorer. Built on first use."""
+        if self._similarity is None:
+            from scipy.sparse import csr_matrix   # Deferred so opening an index stays cheap
+            self._similarity = csr_matrix((self.scores, self.indices, self.indptr), shape=(len(self), len(self)), copy=False)
+        return self._similarity
+
+    def rows_for(self, product_ids):
+        """Maps product ids to row numbers; unknown ids are dropped."""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(self.sorted_ids) or not len(product_ids): return np.array([], dtype=np.int64)
+        pos = np.searchsorted(self.sorted_ids, product_ids)
+        pos[pos >= len(self.sorted_ids)] = 0
+        found = self.sorted_ids[pos] == product_ids
+        return np.asarray(self.sorted_rows[pos[found]])
+
+    def gather(self, rows):
+        """Returns the concatenated (neighbour_rows, scores) of the given rows as one sparse row gather."""
+        starts = np.asarray(self.indptr[rows])
+        lengths = np.asarray(self.indptr[rows + 1]) - starts
+        total = int(lengths.sum())
+        if total == 0: return np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+        # Positions of every stored entry of every requested row, without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return np.asarray(self.indices[offsets]), np.asarray(self.scores[offsets])
@@ -1,51 +1,171 @@
-from collections import defaultdict
+from collections import OrderedDict
+from datetime import datetime, UTC
+import heapq
+import threading
+from .seen_index import user_events_query, DEFAULT_USER_ID
+from .trending import DecayedCounter
+from .metrics import REGISTRY, stage
+
+# Define weights to prioritize categories from positive actions
+ACTION_WEIGHTS = {"seen": 1.0, "reorder": 1.5, "order": 1.2, "cancel": -2.0}
+TOP_CATEGORIES = 3
+AFFINITY_CAPACITY = 32        # Categories ranked per user
+MAX_AFFINITY_USERS = 100000   # Users whose affinities stay in memory (least recently used are dropped)
+MAX_PENDING_EVENTS = 256      # Events kept per user whose affinity has not been seeded yet
+POPULARITY_COLLECTION = 'product_popularity'   # Historical event counts per product, shared by every worker
+
+REQUESTS = REGISTRY.counter('feed_personalization_requests_total', "Personalized section requests by outcome (ranked, no_affinity).", ('outcome',))
+
+
+def _event_time(event):
+    timestamp = event.get('serverTimestamp')
+    if not isinstance(timestamp, datetime): return None
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=UTC)
+
+
+def recount_popularity(db):
+    """Recomputes historical event counts per product on the server and replaces POPULARITY_COLLECTION in one $out."""
+    pipeline = [{'$group': {'_id': '$detail.order_number', 'count': {'$sum': 1}}}, {'$out': POPULARITY_COLLECTION}]
+    db.historical_events.aggregate(pipeline, allowDiskUse=True)
+
 
 class Personalization:
-    def __init__(self, db):
+    """
+    "Based on Your Recent Activity": each user's category affinity is a time-decayed sum of action
+    weights, updated as events are written. The section is a merge of the user's top categories'
+    product lists, which are pre-ranked by popularity, so a request only reads as many products as it returns.
+    """
+    def __init__(self, db, catalog, seen_index=None):
         self.db = db
+        self.catalog = catalog
+        self.seen_index = seen_index
+        self.affinities = OrderedDict()   # user_id -> DecayedCounter over categories
+        self.pending = OrderedDict()      # user_id -> events logged here before the user's affinity was seeded
+        self.lock = threading.Lock()
+        self.popularity = {}              # product_id -> historical event count
+        self.ranked, self.ranked_version = {}, None
+        # Counting is left to the lease holder's refresh job; a worker only reads what it published
+        self.refresh_rankings(recount=False)
 
-    def get_category_recommendations(self):
+    def refresh_rankings(self, recount=True):
         """
-        Finds products from the same categories the user has recently interacted with
-        in the live_events collection. This is the definitive logic.
+        Re-reads product popularity and re-ranks every category's products if it changed. With recount, the counts are
+        first recomputed on the server and replaced in one $out, so other workers can read them without recounting.
+        Returns True if the rankings changed.
         """
-        # Define weights to prioritize categories from positive actions
-        action_weights = {"seen": 1.0, "reorder": 1.5, "order": 1.2, "cancel": -2.0}
-        
-        # 1. Get all recent user activity from the live_events collection
-        live_events = list(self.db.live_events.find())
-
-        if not live_events:
-            print("PERSONALIZATION: No live events found. 'Recent Activity' will be empty.")
-            return []
+        if recount: recount_popularity(self.db)
+        popularity = {}
+        for doc in self.db[POPULARITY_COLLECTION].find({}, {'count': 1}):
+            try: popularity[int(doc['_id'])] = doc['count']
+            except (ValueError, TypeError): continue
+        if popularity == self.popularity and self.ranked_version == self.catalog.reloads: return False
+        self.popularity = popularity
+        self._rank_categories()
+        return True
+
+    def _rank_categories(self):
+        version, popularity = self.catalog.reloads, self.popularity
+        self.ranked = {
+            category: sorted(pids, key=lambda pid: (-popularity.get(pid, 0), pid))
+            for category, pids in self.catalog.by_category.items()
+        }
+        self.ranked_version = version
+        print(f"PERSONALIZATION: Ranked products in {len(self.ranked)} categories.")
 
-        # 2. Score each CATEGORY based on the user's actions
-        category_scores = defaultdict(float)
-        for event in live_events:
-            try:
-                action = event.get('action', '').lower()
-                category = event.get('detail', {}).get('category')
-                if category and action in action_weights:
-                    category_scores[category] += action_weights[action]
-            except (AttributeError):
-                continue
-        
-        # 3. Get the top 3 categories that have a positive score
-        top_categories = [
-            category for category, score in sorted(category_scores.items(), key=lambda item: item[1], reverse=True) if score > 0
-        ][:3] 
+    def _affinity(self, user_id):
+        """
+        The user's affinity counter, seeded from their live events the first time a feed needs it.
+        Events this process logged before then are kept in pending: the seed excludes them by _id and
+        they are added in memory, so an event is counted once whether or not it has been written yet.
+        """
+        with self.lock:
+            counter = self.affinities.get(user_id)
+            if counter is not None:
+                self.affinities.move_to_end(user_id)
+                return counter
+            excluded = [event['_id'] for event in self.pending.get(user_id, ()) if '_id' in event]
+            cutoff = datetime.now(UTC)
+        counter = DecayedCounter(capacity=AFFINITY_CAPACITY)
+        with stage('personalization', 'affinity_load'):
+            # Decayed sums per (category, action) are computed on the server; a handful of rows come back.
+            # Events newer than the cutoff are left to pending as well.
+            match = {**user_events_query(user_id), '_id': {'$nin': excluded}, 'serverTimestamp': {'$lt': cutoff}}
+            pipeline = [
+                {'$match': match},
+                {'$group': {'_id': {'category': '$detail.category', 'action': {'$toLower': '$action'}}, 'weight': {'$sum': counter.mongo_weight()}}},
+            ]
+            for doc in self.db.live_events.aggregate(pipeline):
+                category, action = doc['_id'].get('category'), doc['_id'].get('action')
+                if category and action in ACTION_WEIGHTS:
+                    counter.add(category, ACTION_WEIGHTS[action] * doc['weight'], when=counter.anchor)
+        excluded = set(excluded)
+        with self.lock:
+            existing = self.affinities.get(user_id)
+            if existing is not None: return existing
+            for event in self.pending.pop(user_id, ()):
+                if event.get('_id') in excluded or (_event_time(event) or cutoff) >= cutoff: self._add(counter, event)
+            self.affinities[user_id] = counter
+            while len(self.affinities) > MAX_AFFINITY_USERS: self.affinities.popitem(last=False)
+        return counter
+
+    @staticmethod
+    def _add(counter, event):
+        try:
+            action = event.get('action', '').lower()
+            category = event.get('detail', {}).get('category')
+        except AttributeError:
+            return
+        if category and action in ACTION_WEIGHTS:
+            counter.add(category, ACTION_WEIGHTS[action], _event_time(event))
+
+    def record_event(self, event):
+        """O(1) in-memory update for a newly logged event; never touches the database."""
+        user_id = event.get('user_id', DEFAULT_USER_ID)
+        with self.lock:
+            counter = self.affinities.get(user_id)
+            if counter is not None:
+                self._add(counter, event)
+                return
+            # Not seeded yet: hold the event until the user's next feed seeds the affinity
+            events = self.pending.setdefault(user_id, [])
+            self.pending.move_to_end(user_id)
+            events.append(event)
+            # Events dropped from pending are left to the seed, which reads them back once written
+            if len(events) > MAX_PENDING_EVENTS: del events[0]
+            while len(self.pending) > MAX_AFFINITY_USERS: self.pending.popitem(last=False)
+
+    def _scored(self, category, affinity):
+        # Sorted by popularity, so also sorted by affinity x popularity: heapq.merge can combine the lists lazily
+        popularity = self.popularity
+        return ((-affinity * (1 + popularity.get(pid, 0)), pid) for pid in self.ranked.get(category, []))
+
+    def get_category_recommendations(self, user_id, limit=20):
+        """
+        Up to limit unseen products from the user's top categories, most relevant first.
+        A product's relevance is its category's decayed affinity times its popularity.
+        """
+        # 1. Top 3 categories that have a positive decayed score
+        counter = self._affinity(user_id)
+        now = datetime.now(UTC)
+        top_categories = [(c, counter.score(c, now)) for c in counter.top(TOP_CATEGORIES)]
+        top_categories = [(c, score) for c, score in top_categories if score > 0]
 
         if not top_categories:
-            print("PERSONALIZATION: No positively rated categories from live events.")
+            REQUESTS.inc(outcome='no_affinity')
             return []
-            
-        print(f"PERSONALIZATION: Recommending from top categories: {top_categories}")
-
-        # 4. Find all products from your product catalog that belong to these top categories
-        recommended_products = list(self.db.products.find(
-            {"category": {"$in": top_categories}},
-            {"product_id": 1, "_id": 0} 
-        ))
+        REQUESTS.inc(outcome='ranked')
 
-        # 5. Return the list of product IDs to be displayed
-        return [p['product_id'] for p in recommended_products]
\ No newline at end of file
+        # 2. Merge the pre-ranked category lists lazily, skipping seen products, until limit are found
+        with stage('personalization', 'merge'):
+            if self.ranked_version != self.catalog.reloads: self._rank_categories()
+            merged = heapq.merge(*[self._scored(category, score) for category, score in top_categories])
+            results = []
+            while len(results) < limit:
+                chunk = []
+                for _, pid in merged:
+                    chunk.append(pid)
+                    if len(chunk) >= limit: break
+                if not chunk: break
+                if self.seen_index is not None: chunk = self.seen_index.filter_unseen(user_id, chunk)
+                results.extend(chunk[:limit - len(results)])
+            return results
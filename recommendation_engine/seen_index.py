@@ -0,0 +1,100 @@
+# recommendation_engine/seen_index.py
+from array import array
+from collections import defaultdict
+import threading
+import numpy as np
+
+DEFAULT_USER_ID = 'adhir_samal'   # Owner of live events written before events carried a user_id
+MERGE_THRESHOLD = 64              # Recent ids kept in a set before being merged into the sorted array
+EMPTY = np.array([], dtype=np.int64)
+
+
+def user_events_query(user_id):
+    """Mongo filter for a user's events, including legacy live events that have no user_id."""
+    if user_id == DEFAULT_USER_ID:
+        return {'$or': [{'user_id': user_id}, {'user_id': {'$exists': False}}]}
+    return {'user_id': user_id}
+
+
+def _int_ids(order_numbers):
+    for order_number in order_numbers:
+        try: yield int(order_number)
+        except (ValueError, TypeError): continue
+
+
+def event_product_id(event):
+    try: return int(event['detail']['order_number'])
+    except (KeyError, ValueError, TypeError): return None
+
+
+class SeenIndex:
+    """
+    Per-user set of product ids the user has already interacted with.
+    Each user holds a sorted int64 array plus a small set of recent additions, so membership
+    checks never touch the database and memory stays at ~8 bytes per seen item.
+    The index is built by build() after the worker has started serving; until it is ready, a user's
+    set is read with two indexed distinct queries the first time their feed needs it.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.users = {}      # user_id -> [sorted np.int64 array, or None if not loaded; set of ids not merged yet]
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Distinct (user, product) pairs of historical and live events, de-duplicated on the server."""
+        collected = defaultdict(lambda: array('q'))
+        pipeline = [{'$group': {'_id': '$user_id', 'product_ids': {'$addToSet': '$detail.order_number'}}}]
+        for source in (self.db.historical_events, self.db.live_events):
+            for doc in source.aggregate(pipeline, allowDiskUse=True):
+                collected[doc['_id'] if doc['_id'] is not None else DEFAULT_USER_ID].extend(_int_ids(doc['product_ids']))
+        seen = {user_id: np.unique(np.frombuffer(ids, dtype=np.int64)) for user_id, ids in collected.items()}
+        with self.lock:
+            # Users loaded or updated while the build ran keep what they have on top of it
+            for user_id, ids in seen.items():
+                entry = self.users.setdefault(user_id, [None, set()])
+                entry[0] = ids if entry[0] is None else np.union1d(entry[0], ids)
+            self.ready.set()
+        print(f"SEEN_INDEX: Indexed seen items for {len(seen)} users.")
+
+    def _load(self, user_id):
+        ids = array('q')
+        for source in (self.db.historical_events, self.db.live_events):
+            ids.extend(_int_ids(source.distinct('detail.order_number', user_events_query(user_id))))
+        return np.unique(np.frombuffer(ids, dtype=np.int64))
+
+    def add(self, user_id, product_id):
+        with self.lock:
+            entry = self.users.setdefault(user_id, [None, set()])
+            entry[1].add(int(product_id))
+            if len(entry[1]) >= MERGE_THRESHOLD:
+                if entry[0] is not None or self.ready.is_set():
+                    entry[0] = np.union1d(entry[0] if entry[0] is not None else EMPTY, np.fromiter(entry[1], dtype=np.int64))
+                    entry[1] = set()
+                else:
+                    # Not loaded yet: the load reads back every event already written, so only the newest is kept
+                    entry[1] = {int(product_id)}
+
+    def record_event(self, event):
+        product_id = event_product_id(event)
+        if product_id is not None: self.add(event.get('user_id', DEFAULT_USER_ID), product_id)
+
+    def _get(self, user_id):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is None: return None, set()
+            return entry[0], set(entry[1])
+
+    def filter_unseen(self, user_id, product_ids):
+        """Returns product_ids, in order, without the ones the user has already seen."""
+        if not product_ids: return []
+        seen, recent = self._get(user_id)
+        if seen is None and not self.ready.is_set():
+            loaded = self._load(user_id)
+            with self.lock:
+                entry = self.users.setdefault(user_id, [None, set()])
+                entry[0] = loaded if entry[0] is None else np.union1d(entry[0], loaded)
+            seen, recent = self._get(user_id)
+        candidates = np.asarray(product_ids, dtype=np.int64)
+        keep = np.ones(len(candidates), dtype=bool) if seen is None else ~np.isin(candidates, seen)
+        return [pid for pid, k in zip(candidates.tolist(), keep.tolist()) if k and pid not in recent]
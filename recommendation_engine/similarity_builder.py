@@ -0,0 +1,119 @@
+# recommendation_engine/similarity_builder.py
+from array import array
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, diags
+
+# Interaction strength per action; anything else that gets through the filter counts as a view
+ACTION_STRENGTH = {"order": 2.0, "seen": 1.0}
+MODEL_ACTIONS = ["Seen", "Order"]
+TOP_K = 50               # Neighbours kept per item
+BLOCK_SIZE = 1024        # Item rows multiplied per sparse block
+CURSOR_BATCH_SIZE = 5000
+
+
+def _strength_expression():
+    # ACTION_STRENGTH as an aggregation expression on the lower-cased action
+    action = {'$toLower': '$action'}
+    branches = [{'case': {'$eq': [action, name]}, 'then': strength} for name, strength in ACTION_STRENGTH.items()]
+    return {'$switch': {'branches': branches, 'default': 1.0}}
+
+
+def stream_interactions(collection, actions=MODEL_ACTIONS):
+    """
+    Streams (user_id, product_id, strength) tuples from an events collection, one per distinct
+    (user, product) pair. Pairs are grouped on the server and their strength is averaged there,
+    so the transfer is proportional to distinct pairs rather than to events.
+    """
+    pipeline = [
+        {'$match': {'action': {'$in': actions}, 'user_id': {'$ne': None}}},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'order_number': '$detail.order_number'},
+            'strength': {'$avg': _strength_expression()},
+        }},
+    ]
+    for doc in collection.aggregate(pipeline, allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE):
+        key = doc['_id']
+        order_number = key.get('order_number')
+        if not order_number: continue
+        try: product_id = int(order_number)
+        except (ValueError, TypeError): continue
+        yield key['user_id'], product_id, doc['strength']
+
+
+def build_interaction_matrix(interactions, with_users=False):
+    """
+    Integer-codes users and products on the fly and assembles a sparse user x item CSR matrix.
+    Repeated (user, product) pairs are averaged, matching the old pivot_table behaviour.
+    Returns (matrix, product_ids) where product_ids[col] is the product behind each column,
+    or (matrix, product_ids, user_ids) with user_ids[row] as well when with_users is set.
+    """
+    user_codes, product_codes = {}, {}
+    rows, cols, values = array('q'), array('q'), array('f')
+    for user_id, product_id, strength in interactions:
+        rows.append(user_codes.setdefault(user_id, len(user_codes)))
+        cols.append(product_codes.setdefault(product_id, len(product_codes)))
+        values.append(strength)
+
+    if not values:
+        empty = np.array([], dtype=np.int64)
+        return (None, empty, []) if with_users else (None, empty)
+
+    rows, cols = np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64)
+    shape = (len(user_codes), len(product_codes))
+    totals = coo_matrix((np.frombuffer(values, dtype=np.float32), (rows, cols)), shape=shape).tocsr()
+    counts = coo_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape).tocsr()
+    # Both matrices share the same canonical sparsity pattern, so the data arrays line up
+    totals.data /= counts.data
+
+    product_ids = np.fromiter(product_codes.keys(), dtype=np.int64, count=len(product_codes))
+    if with_users: return totals, product_ids, list(user_codes)
+    return totals, product_ids
+
+
+def top_k_cosine(matrix, k=TOP_K, block_size=BLOCK_SIZE):
+    """
+    Computes the k most cosine-similar items for every item (column) of a user x item matrix.
+    Similarities are produced one block of item rows at a time, so memory is bounded by
+    block_size x n_items instead of n_items^2. Returns an item x item CSR matrix with at most
+    k entries per row, sorted by descending score, excluding the item itself.
+    """
+    items = matrix.T.tocsr().astype(np.float32)
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    items = (diags(1.0 / norms) @ items).tocsr()
+    items_t = items.T.tocsr()
+
+    n_items = items.shape[0]
+    counts = np.zeros(n_items, dtype=np.int64)
+    out_indices, out_scores = [], []
+    for start in range(0, n_items, block_size):
+        block = (items[start:start + block_size] @ items_t).tocsr()
+        for r in range(block.shape[0]):
+            lo, hi = block.indptr[r], block.indptr[r + 1]
+            cols, vals = block.indices[lo:hi], block.data[lo:hi]
+            keep = (cols != start + r) & (vals > 0)
+            cols, vals = cols[keep], vals[keep]
+            if len(vals) > k:
+                top = np.argpartition(-vals, k - 1)[:k]
+                cols, vals = cols[top], vals[top]
+            order = np.argsort(-vals, kind='stable')
+            out_indices.append(cols[order])
+            out_scores.append(vals[order])
+            counts[start + r] = len(order)
+
+    indptr = np.zeros(n_items + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.concatenate(out_indices).astype(np.int32) if out_indices else np.array([], dtype=np.int32)
+    scores = np.concatenate(out_scores).astype(np.float32) if out_scores else np.array([], dtype=np.float32)
+    return csr_matrix((scores, indices, indptr), shape=(n_items, n_items))
+
+
+def build_item_similarity(collection, k=TOP_K, block_size=BLOCK_SIZE):
+    """
+    End-to-end build shared by the scheduler in app.py and scripts/compute_similarity_matrix.py.
+    Returns (product_ids, neighbours) or (None, None) when there is nothing to build from.
+    """
+    matrix, product_ids = build_interaction_matrix(stream_interactions(collection))
+    if matrix is None: return None, None
+    return product_ids, top_k_cosine(matrix, k=k, block_size=block_size)
+
@@ -1,37 +1,171 @@
 # recommendation_engine/trending.py
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime, timedelta, UTC
+import heapq
 import math
+import threading
 from config import TIME_DECAY_LAMBDA
 
+SNAPSHOT_ID = 'trending'  # model_state document holding the shared counters
+SNAPSHOT_KEYS = 5000      # Highest scores kept in the shared snapshot
+MAX_RECENT_EVENTS = 100000   # Events logged in this process kept for replay onto a newer snapshot
+TOP_CAPACITY = 100        # Leaders kept ready for constant-time reads
+REBASE_EXPONENT = 50.0    # Re-anchor scores before exp() grows large enough to lose precision
+
+
+class DecayedCounter:
+    """
+    Exponentially time-decayed counters. Every key decays by the same factor, so scores are kept
+    relative to a fixed anchor time: an increment adds exp(lambda * age_of_anchor) and a read divides
+    it back out. Increments are O(1) and the ranking only changes when a key is incremented.
+    """
+    def __init__(self, decay_lambda=TIME_DECAY_LAMBDA, capacity=TOP_CAPACITY, anchor=None):
+        self.decay_lambda = decay_lambda
+        self.capacity = capacity
+        self.anchor = anchor or datetime.now(UTC)
+        self.scores = {}
+        self.leaders = []     # Keys of the highest scores, best first
+        self.lock = threading.Lock()
+
+    def _hours(self, when):
+        return (when - self.anchor).total_seconds() / 3600
+
+    def _rebase(self, when):
+        factor = math.exp(-self.decay_lambda * self._hours(when))
+        self.scores = {k: v * factor for k, v in self.scores.items()}
+        self.anchor = when
+
+    def add(self, key, weight=1.0, when=None):
+        when = when or datetime.now(UTC)
+        with self.lock:
+            if self.decay_lambda * self._hours(when) > REBASE_EXPONENT: self._rebase(when)
+            score = self.scores.get(key, 0.0) + weight * math.exp(self.decay_lambda * self._hours(when))
+            self.scores[key] = score
+            # Keep the leader board sorted; it is small, so this stays O(1) in the number of keys.
+            # A new list is swapped in so lock-free readers never see it mid-sort.
+            leaders = self.leaders
+            if key in leaders or len(leaders) < self.capacity or score > self.scores[leaders[-1]]:
+                candidates = leaders if key in leaders else leaders + [key]
+                self.leaders = sorted(candidates, key=self.scores.__getitem__, reverse=True)[:self.capacity]
+
+    def mongo_weight(self, field='$serverTimestamp'):
+        """
+        Aggregation expression for the raw increment add() would make for an event at field's time,
+        so $sum over it yields scores relative to this counter's anchor. Missing times count as the anchor.
+        """
+        anchor = self.anchor.astimezone(UTC).replace(tzinfo=None)   # BSON dates are UTC
+        hours = {'$divide': [{'$subtract': [{'$ifNull': [field, anchor]}, anchor]}, 3600000]}
+        return {'$exp': {'$multiply': [self.decay_lambda, hours]}}
+
+    def top(self, n):
+        return self.leaders[:n]
+
+    def score(self, key, now=None):
+        now = now or datetime.now(UTC)
+        return self.scores.get(key, 0.0) * math.exp(-self.decay_lambda * self._hours(now))
+
+    def to_dict(self, limit=None):
+        """Serializable state; with limit, only the limit highest scores are kept."""
+        with self.lock:
+            scores = self.scores.items() if limit is None else heapq.nlargest(limit, self.scores.items(), key=lambda kv: kv[1])
+            return {'decay_lambda': self.decay_lambda, 'anchor': self.anchor.isoformat(), 'scores': [[k, v] for k, v in scores]}
+
+    @classmethod
+    def from_dict(cls, data, capacity=TOP_CAPACITY):
+        counter = cls(data['decay_lambda'], capacity, datetime.fromisoformat(data['anchor']))
+        counter.scores = {k: v for k, v in data['scores']}
+        counter.leaders = sorted(counter.scores, key=counter.scores.__getitem__, reverse=True)[:capacity]
+        return counter
+
+
 class Trending:
-    def __init__(self, db_events):
-        self.db_events = db_events
+    """
+    Streaming "Trending Now" engine. Event writes feed record_event() and lookups are a read of the
+    current leaders. A worker only sees its own share of the events, so the lease holder periodically
+    recounts live_events on the server and publishes the counters to model_state. Every worker swaps
+    that snapshot in and replays the events it logged since, so all workers rank on the whole traffic.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.recent = deque(maxlen=MAX_RECENT_EVENTS)   # (time, product_id) of events logged in this process
+        self.lock = threading.Lock()
+        # Nothing is counted here: until a snapshot is published, only this process's events are ranked
+        snapshot = self._read_snapshot()
+        self.counter, self.snapshot_at = snapshot if snapshot else (DecayedCounter(), None)
 
-    def get_scores(self):
+    def _read_snapshot(self):
+        """(counter, computed_at) of the shared snapshot, or None if none has been published."""
+        data = self.db.model_state.find_one({'_id': SNAPSHOT_ID}, {'_id': 0})
+        if not data or data.get('decay_lambda') != TIME_DECAY_LAMBDA: return None
+        try: return DecayedCounter.from_dict(data), datetime.fromisoformat(data['computed_at'])
+        except (KeyError, ValueError): return None
+
+    def _count_events(self, until):
         """
-        Calculates trending scores based on all user actions in the last 48 hours.
+        Counts the 48 hours of live events before until, or history if there are none. Events are
+        counted per product on the server, so only one (product, score) row per product is transferred.
         """
-        # Fetch all 'order' events from the last 48 hours
-        forty_eight_hours_ago = datetime.utcnow() - timedelta(hours=48)
-        recent_orders = self.db_events.find({"action": "order", "timestamp": {"$gte": forty_eight_hours_ago}})
-        
-        product_scores = {}
-        now = datetime.utcnow()
-
-        for event in recent_orders:
-            product_id = event['product_id']
-            timestamp = event['timestamp']
-            
-            hours_diff = (now - timestamp).total_seconds() / 3600
-            decay_factor = math.exp(-TIME_DECAY_LAMBDA * hours_diff)
-            
-            product_scores[product_id] = product_scores.get(product_id, 0) + decay_factor
-
-        # Normalize scores
-        if not product_scores:
+        counter = DecayedCounter()
+        sources = (
+            (self.db.live_events, {'serverTimestamp': {'$gte': until - timedelta(hours=48), '$lt': until}}, counter.mongo_weight()),
+            (self.db.historical_events, {}, 1),   # Historical events all count as "now" without decay, as before
+        )
+        seeded = 0
+        for source, query, weight in sources:
+            pipeline = [
+                {'$match': query},
+                {'$group': {'_id': '$detail.order_number', 'score': {'$sum': weight}, 'events': {'$sum': 1}}},
+            ]
+            for doc in source.aggregate(pipeline, allowDiskUse=True):
+                try: product_id = int(doc['_id'])
+                except (ValueError, TypeError): continue
+                counter.add(product_id, doc['score'], when=counter.anchor)   # Raw scores are already anchor-relative
+                seeded += doc['events']
+            if seeded: break
+        print(f"TRENDING: Counted {seeded} events.")
+        return counter
+
+    def record_event(self, event):
+        """O(1) update for a newly logged event."""
+        try: product_id = int(event['detail']['order_number'])
+        except (KeyError, ValueError, TypeError): return
+        when = event.get('serverTimestamp')
+        when = (when if when.tzinfo else when.replace(tzinfo=UTC)) if isinstance(when, datetime) else datetime.now(UTC)
+        with self.lock:
+            self.recent.append((when, product_id))
+            self.counter.add(product_id, when=when)
+
+    def publish(self):
+        """Recounts live_events and stores the counters as the shared snapshot. Run by the lease holder only."""
+        until = datetime.now(UTC)
+        data = self._count_events(until).to_dict(limit=SNAPSHOT_KEYS)
+        self.db.model_state.replace_one({'_id': SNAPSHOT_ID}, {**data, 'computed_at': until.isoformat()}, upsert=True)
+
+    def reload(self):
+        """Swaps in a newer shared snapshot. Returns True if that changed the leaders."""
+        state = self.db.model_state.find_one({'_id': SNAPSHOT_ID}, {'computed_at': 1})
+        if not state or state.get('computed_at') == (self.snapshot_at and self.snapshot_at.isoformat()): return False
+        snapshot = self._read_snapshot()
+        if snapshot is None: return False
+        counter, computed_at = snapshot
+        with self.lock:
+            # Events logged here since the recount are not in it. Ones logged before it but still queued
+            # for writing are missed until the next recount.
+            while self.recent and self.recent[0][0] < computed_at: self.recent.popleft()
+            for when, product_id in self.recent: counter.add(product_id, when=when)
+            changed = counter.leaders != self.counter.leaders
+            self.counter, self.snapshot_at = counter, computed_at
+        print("TRENDING: Loaded the shared snapshot.")
+        return changed
+
+    def get_trending(self, n=20):
+        return self.counter.top(n)
+
+    def get_scores(self):
+        """Trending scores of the current leaders, normalized to 0..1."""
+        counter, now = self.counter, datetime.now(UTC)
+        scores = {pid: counter.score(pid, now) for pid in counter.top(counter.capacity)}
+        if not scores:
             return {}
-            
-        max_score = max(product_scores.values())
-        normalized_scores = {pid: score / max_score for pid, score in product_scores.items()}
-        
-        return normalized_scores
\ No newline at end of file
+        max_score = max(scores.values())
+        return {pid: score / max_score for pid, score in scores.items()}
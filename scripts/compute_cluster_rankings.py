@@ -0,0 +1,24 @@
+# scripts/compute_cluster_rankings.py
+import sys
+from pymongo import MongoClient
+
+from config import MONGO_URI, DATABASE_NAME
+from recommendation_engine.cluster_popularity import rebuild_cluster_rankings, refresh_cluster_rankings
+
+def compute_cluster_rankings(incremental=False):
+    """
+    Materializes the ranked product list of every user cluster into db.cluster_rankings.
+    With incremental=True only historical events added since the last run are folded in.
+    """
+    print("Connecting to MongoDB...")
+    client = MongoClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+
+    if incremental:
+        refresh_cluster_rankings(db)
+    else:
+        rebuild_cluster_rankings(db)
+    print("Cluster rankings are up to date.")
+
+if __name__ == "__main__":
+    compute_cluster_rankings(incremental='--incremental' in sys.argv)
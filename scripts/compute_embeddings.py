@@ -0,0 +1,31 @@
+# scripts/compute_embeddings.py
+import time
+from pymongo import MongoClient
+
+from config import MONGO_URI, DATABASE_NAME
+from recommendation_engine.embeddings import build_embeddings, write_embeddings, EMBEDDINGS_PATH
+
+def compute_and_save_embeddings():
+    """
+    Factorizes the user x item interaction matrix into item and user embeddings and saves them,
+    with their LSH index, for /api/similar and the embedding-based "For You" section.
+    """
+    print("Connecting to MongoDB...")
+    client = MongoClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+
+    print("Computing embeddings...")
+    started = time.perf_counter()
+    built = build_embeddings(db.historical_events)
+    if built is None:
+        print("No historical events found. Nothing to compute.")
+        return
+
+    product_ids, item_vectors, user_ids, user_vectors = built
+    meta = write_embeddings(product_ids, item_vectors, user_ids, user_vectors)
+    print(f"Embedded {meta['n_items']} items and {meta['n_users']} users in {meta['dimensions']} dimensions "
+          f"({time.perf_counter() - started:.1f}s).")
+    print(f"Embeddings ('{EMBEDDINGS_PATH}') have been computed and saved.")
+
+if __name__ == "__main__":
+    compute_and_save_embeddings()
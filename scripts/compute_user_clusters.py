@@ -1,52 +1,108 @@
 # scripts/compute_user_clusters.py
-import pandas as pd
-from pymongo import MongoClient
-from sklearn.cluster import KMeans
+import time
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 
 from config import MONGO_URI, DATABASE_NAME
+from recommendation_engine.cluster_popularity import rebuild_cluster_rankings
+from recommendation_engine.cluster_assignment import save_cluster_model, MODEL_PATH
+
+FIT_BATCH_SIZE = 4096     # Users per partial_fit step
+FIT_EPOCHS = 5            # Passes over the user x category matrix
+WRITE_BATCH_SIZE = 1000   # UpdateOne operations per bulk_write
+
+
+def aggregate_user_categories(db):
+    """
+    Counts each user's events per category on the server and streams the (user, category, count)
+    rows back, so only the aggregated counts ever leave MongoDB.
+    Returns (user_ids, categories, counts) with counts as a dense users x categories float array.
+    """
+    pipeline = [
+        {'$match': {'user_id': {'$ne': None}, 'detail.category': {'$ne': None}}},
+        {'$group': {'_id': {'user_id': '$user_id', 'category': '$detail.category'}, 'count': {'$sum': 1}}},
+    ]
+    user_codes, category_codes, rows = {}, {}, []
+    for doc in db.historical_events.aggregate(pipeline, allowDiskUse=True, batchSize=10000):
+        key = doc['_id']
+        rows.append((
+            user_codes.setdefault(key.get('user_id'), len(user_codes)),
+            category_codes.setdefault(key['category'], len(category_codes)),
+            doc['count'],
+        ))
+    counts = np.zeros((len(user_codes), len(category_codes)), dtype=np.float64)
+    for user, category, count in rows: counts[user, category] = count
+    return list(user_codes), list(category_codes), counts
+
 
 def create_user_clusters(num_clusters=8):
     """
     Analyzes user interaction history with categories and groups users into clusters.
     """
+    timings = {}
+    started = phase = time.perf_counter()
+    def mark(name):
+        nonlocal phase
+        now = time.perf_counter()
+        timings[name] = now - phase
+        phase = now
+
     print("Connecting to MongoDB...")
     client = MongoClient(MONGO_URI)
     db = client[DATABASE_NAME]
-    
-    # 1. Fetch all historical events
-    events = list(db.historical_events.find({}, {"user_id": 1, "detail.category": 1}))
-    df = pd.json_normalize(events)
-    df.rename(columns={'detail.category': 'category'}, inplace=True)
-    print(f"Fetched {len(df)} historical events.")
-
-    if df.empty:
+
+    # 1. Aggregate a user-category interaction matrix on the server
+    user_ids, categories, user_category_matrix = aggregate_user_categories(db)
+    mark('aggregate')
+    print(f"Aggregated {len(user_ids)} users across {len(categories)} categories.")
+
+    if not user_ids:
         print("No historical events to process for clustering.")
         return
 
-    # 2. Create a user-category interaction matrix
-    # This counts how many times each user interacted with each category
-    user_category_matrix = pd.crosstab(df['user_id'], df['category'])
-
-    # 3. Scale the data for better K-Means performance
+    # 2. Scale the data for better K-Means performance, one batch at a time
     scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(user_category_matrix)
+    for start in range(0, len(user_ids), FIT_BATCH_SIZE):
+        scaler.partial_fit(user_category_matrix[start:start + FIT_BATCH_SIZE])
+    scaled_features = scaler.transform(user_category_matrix)
+    mark('scale')
+
+    # 3. Fit Mini-Batch K-Means incrementally, then assign every user to a cluster
+    n_clusters = min(num_clusters, len(user_ids))
+    print(f"Applying Mini-Batch K-Means to group users into {n_clusters} clusters...")
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=FIT_BATCH_SIZE, n_init=3)
+    rng = np.random.default_rng(42)
+    for _ in range(FIT_EPOCHS):
+        order = rng.permutation(len(user_ids))
+        for start in range(0, len(order), FIT_BATCH_SIZE):
+            batch = scaled_features[order[start:start + FIT_BATCH_SIZE]]
+            # The first partial_fit initializes the centroids and needs at least n_clusters samples
+            if not hasattr(kmeans, 'cluster_centers_') and len(batch) < n_clusters: batch = scaled_features
+            kmeans.partial_fit(batch)
+    cluster_ids = kmeans.predict(scaled_features)
+    mark('fit')
 
-    # 4. Apply K-Means clustering
-    print(f"Applying K-Means to group users into {num_clusters} clusters...")
-    kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init=10)
-    user_category_matrix['cluster_id'] = kmeans.fit_predict(scaled_features)
+    # Saved so the server can assign new users to the nearest centroid without re-clustering
+    save_cluster_model(categories, scaler, kmeans)
+    print(f"Saved scaler and centroids to '{MODEL_PATH}'.")
 
-    # 5. Update each user in the 'users' collection with their new cluster ID
+    # 4. Persist every user's cluster ID with chunked bulk writes
     print("Updating users in the database with their assigned cluster ID...")
-    for user_id, row in user_category_matrix.iterrows():
-        cluster_id = int(row['cluster_id'])
-        db.users.update_one(
-            {'user_id': user_id},
-            {'$set': {'cluster_id': cluster_id}}
-        )
-    
+    ops = [UpdateOne({'user_id': user_id}, {'$set': {'cluster_id': int(cluster_id)}, '$unset': {'online_cluster': ''}}) for user_id, cluster_id in zip(user_ids, cluster_ids)]
+    for start in range(0, len(ops), WRITE_BATCH_SIZE):
+        db.users.bulk_write(ops[start:start + WRITE_BATCH_SIZE], ordered=False)
+    mark('write')
+
     print("User clustering complete. All users have been assigned a cluster_id.")
 
+    # 5. Cluster membership changed, so the per-cluster rankings are rebuilt from scratch
+    rebuild_cluster_rankings(db)
+    mark('rankings')
+
+    report = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+    print(f"Timings: {report} (total {time.perf_counter() - started:.2f}s)")
+
 if __name__ == "__main__":
-    create_user_clusters()
\ No newline at end of file
+    create_user_clusters()
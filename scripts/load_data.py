@@ -1,67 +1,142 @@
 # scripts/load_data.py
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+import time
+import numpy as np
 import pandas as pd
 from pymongo import MongoClient
-from datetime import datetime, timedelta
-import random
 
 from config import MONGO_URI, DATABASE_NAME
+from recommendation_engine.catalog import bump_catalog_version
+from recommendation_engine.cluster_popularity import begin_history_load, end_history_load
+from recommendation_engine.indexes import ensure_indexes
 
-def populate_database():
+CSV_PATH = 'data/Online-eCommerce.csv'
+CHUNK_ROWS = 50000        # CSV rows parsed at a time
+WRITE_BATCH_SIZE = 5000   # Documents per insert_many
+WRITERS = 4               # Parallel bulk writers
+DEFAULT_WEIGHTS = { "w1_collaborative": 0.50, "w2_personal": 0.40, "w3_trending": 0.10 }
+
+
+class BulkWriter:
+    """Runs unordered insert_many batches on a small thread pool, with a bounded number in flight."""
+    def __init__(self, workers=WRITERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = workers * 2
+        self.pending = set()
+
+    def insert(self, collection, documents):
+        for start in range(0, len(documents), WRITE_BATCH_SIZE):
+            if len(self.pending) >= self.max_pending: self._collect(FIRST_COMPLETED)
+            batch = documents[start:start + WRITE_BATCH_SIZE]
+            self.pending.add(self.pool.submit(collection.insert_many, batch, ordered=False))
+
+    def _collect(self, return_when):
+        done, self.pending = wait(self.pending, return_when=return_when)
+        for future in done: future.result()   # Surface write errors
+
+    def close(self):
+        self._collect(ALL_COMPLETED)
+        self.pool.shutdown()
+
+
+def clean_chunk(df):
+    df = df.rename(columns={'Order_Number': 'product_id', 'Product': 'product_name', 'Category': 'category', 'Brand': 'brand'})
+    df = df.dropna(subset=['product_id', 'product_name', 'Customer_Name'])
+    df['product_id'] = pd.to_numeric(df['product_id'], errors='coerce', downcast='integer')
+    df = df.dropna(subset=['product_id'])
+    df['product_id'] = df['product_id'].astype(int)
+    for col in ['product_name', 'category', 'brand', 'Customer_Name']:
+        df[col] = df[col].astype(str)
+    df['user_id'] = df['Customer_Name'].str.lower().str.replace(" ", "_", regex=False)
+    df['order_time'] = pd.to_datetime(df['Order_Date'], format='%d/%m/%Y', errors='coerce')
+    return df
+
+
+def build_events(df, rng):
+    """Order and Seen events for every row with a valid order date, built column-wise."""
+    df = df.dropna(subset=['order_time'])
+    order_times = df['order_time'].dt.to_pydatetime()
+    seen_offsets = pd.to_timedelta(rng.integers(5, 61, size=len(df)), unit='m')
+    seen_times = (df['order_time'] - seen_offsets).dt.to_pydatetime()
+    details = [
+        { "category": category, "order_number": str(product_id), "product": product_name, "brand": brand }
+        for category, product_id, product_name, brand in zip(df['category'], df['product_id'], df['product_name'], df['brand'])
+    ]
+    events = []
+    for user_id, detail, order_time, seen_time in zip(df['user_id'], details, order_times, seen_times):
+        events.append({ "user_id": user_id, "action": "Order", "detail": detail, "serverTimestamp": order_time })
+        events.append({ "user_id": user_id, "action": "Seen", "detail": detail, "serverTimestamp": seen_time })
+    return events
+
+
+def populate_database(csv_path=CSV_PATH, chunk_rows=CHUNK_ROWS):
     """
-    Reads the eCommerce CSV, cleans the data, and populates the database
-    with a SEPARATE collection for historical events.
+    Reads the eCommerce CSV in chunks, cleans the data, and populates the database
+    with a SEPARATE collection for historical events. Memory is bounded by the chunk size
+    plus the sets of already inserted product and user ids.
     """
     print("Connecting to MongoDB...")
     client = MongoClient(MONGO_URI)
     db = client[DATABASE_NAME]
 
     # Clear existing collections
+    begin_history_load(db)
     db.products.drop()
     db.users.drop()
     db.historical_events.drop() # 💡 CHANGED
     db.live_events.drop()      # 💡 ADDED for a clean start
+    db.feeds.drop()            # Precomputed against the old catalog and users
     print("Cleared existing collections.")
 
-    # --- Load and Clean Products ---
-    df = pd.read_csv('data/Online-eCommerce.csv')
-    df.rename(columns={'Order_Number': 'product_id', 'Product': 'product_name', 'Category': 'category', 'Brand': 'brand'}, inplace=True)
-    
-    df.dropna(subset=['product_id', 'product_name', 'Customer_Name'], inplace=True)
-    df['product_id'] = pd.to_numeric(df['product_id'], errors='coerce', downcast='integer')
-    df.dropna(subset=['product_id'], inplace=True)
-    df['product_id'] = df['product_id'].astype(int)
-    for col in ['product_name', 'category', 'brand', 'Customer_Name']:
-        df[col] = df[col].astype(str)
-    print("Data loaded and cleaned successfully.")
-
-    products_df = df[['product_id', 'product_name', 'category', 'brand']].drop_duplicates(subset='product_id')
-    products_data = products_df.to_dict(orient='records')
-    db.products.insert_many(products_data)
-    print(f"Inserted {len(products_data)} unique products.")
-
-    # --- Simulate Events and Users ---
-    users, events = {}, []
-    unique_customers = df['Customer_Name'].unique()
-
-    for customer_name in unique_customers:
-        if isinstance(customer_name, str):
-            user_id = customer_name.lower().replace(" ", "_")
-            users[user_id] = { "user_id": user_id, "name": customer_name, "weights": { "w1_collaborative": 0.50, "w2_personal": 0.40, "w3_trending": 0.10 } }
-            customer_orders = df[df['Customer_Name'] == customer_name]
-            for _, row in customer_orders.iterrows():
-                try:
-                    event_time = datetime.strptime(row['Order_Date'], '%d/%m/%Y')
-                    # This now creates events with the full detail structure
-                    event_detail = { "category": row['category'], "order_number": str(row['product_id']), "product": row['product_name'], "brand": row['brand'] }
-                    events.append({ "user_id": user_id, "action": "Order", "detail": event_detail, "serverTimestamp": event_time })
-                    events.append({ "user_id": user_id, "action": "Seen", "detail": event_detail, "serverTimestamp": event_time - timedelta(minutes=random.randint(5, 60)) })
-                except (ValueError, TypeError): continue
-
-    # 💡 CHANGED: Insert into the historical collection
-    db.historical_events.insert_many(events)
-    db.users.insert_many(list(users.values()))
-    print(f"Inserted {len(users)} users and {len(events)} HISTORICAL events.")
+    started = time.perf_counter()
+    rng = np.random.default_rng()
+    writer = BulkWriter()
+    seen_products, seen_users = set(), set()
+    rows = product_count = user_count = event_count = 0
+
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows):
+        rows += len(chunk)
+        df = clean_chunk(chunk)
+
+        # --- Products not inserted by an earlier chunk ---
+        products_df = df[['product_id', 'product_name', 'category', 'brand']].drop_duplicates(subset='product_id')
+        products_df = products_df[~products_df['product_id'].isin(seen_products)]
+        seen_products.update(products_df['product_id'].tolist())
+        writer.insert(db.products, products_df.to_dict(orient='records'))
+        product_count += len(products_df)
+
+        # --- Users, one per customer name ---
+        customers = df.groupby('user_id', sort=False)['Customer_Name'].first()
+        customers = customers[~customers.index.isin(seen_users)]
+        seen_users.update(customers.index)
+        writer.insert(db.users, [
+            { "user_id": user_id, "name": name, "weights": dict(DEFAULT_WEIGHTS) } for user_id, name in customers.items()
+        ])
+        user_count += len(customers)
+
+        # --- Simulated historical events ---
+        # 💡 CHANGED: Insert into the historical collection
+        events = build_events(df, rng)
+        writer.insert(db.historical_events, events)
+        event_count += len(events)
+
+        elapsed = time.perf_counter() - started
+        print(f"  ...{rows} rows processed ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+
+    writer.close()
+    # Only now is every event at or below the newest _id committed
+    end_history_load(db)
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {product_count} unique products.")
+    print(f"Inserted {user_count} users and {event_count} HISTORICAL events.")
+    print(f"Loaded {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s).")
+
+    # Built once after the bulk load, which is faster than maintaining them during the inserts
+    ensure_indexes(db)
+
+    # Running servers reload their product catalog cache when the version changes
+    bump_catalog_version(db)
     print("Database population complete.")
 
 if __name__ == "__main__":
-    populate_database()
\ No newline at end of file
+    populate_database()
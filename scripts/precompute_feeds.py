@@ -0,0 +1,66 @@
+# scripts/precompute_feeds.py
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+from pymongo import MongoClient
+
+from config import MONGO_URI, DATABASE_NAME, FEED_SIZE
+from recommendation_engine.engine import RecommendationEngine
+from recommendation_engine.feed_store import FeedStore
+from recommendation_engine.personalization import POPULARITY_COLLECTION, recount_popularity
+from recommendation_engine.trending import Trending
+
+CHUNK_SIZE = 200   # Users per task handed to a worker process
+
+_engine = None
+
+
+def _init_worker():
+    """Each worker process opens its own connection and builds its own in-memory indexes once."""
+    global _engine
+    client = MongoClient(MONGO_URI)
+    # No latency budgets offline: a section is waited for instead of degrading to an empty fallback
+    _engine = RecommendationEngine(client[DATABASE_NAME], section_budgets=None)
+    _engine.seen_index.build()
+
+
+def _compute_chunk(user_ids):
+    feeds = {}
+    for user_id in user_ids:
+        degraded = set()
+        sections = _engine.get_recommendations_separated(user_id, FEED_SIZE, degraded=degraded)
+        # A feed with a failed section is left out, so /api/feed computes it live instead of serving the gap for hours
+        if not degraded: feeds[user_id] = sections
+    skipped = len(user_ids) - len(feeds)
+    if skipped: print(f"Skipped {skipped} feeds with failed sections.")
+    return FeedStore.write(_engine.db, feeds)
+
+
+def precompute_feeds(workers=None):
+    """
+    Computes all three feed sections for every user in db.users with a process pool
+    and writes them to db.feeds with a per-user computed_at freshness timestamp.
+    """
+    print("Connecting to MongoDB...")
+    client = MongoClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+    db.feeds.create_index('user_id', unique=True)
+    # Worker engines only read the shared counts, so they are published first if no server has done it yet
+    if db[POPULARITY_COLLECTION].find_one() is None: recount_popularity(db)
+    trending = Trending(db)
+    if trending.snapshot_at is None: trending.publish()
+
+    user_ids = [u['user_id'] for u in db.users.find({}, {'_id': 0, 'user_id': 1})]
+    chunks = [user_ids[i:i + CHUNK_SIZE] for i in range(0, len(user_ids), CHUNK_SIZE)]
+    workers = workers or os.cpu_count()
+    print(f"Precomputing feeds for {len(user_ids)} users with {workers} workers...")
+
+    start, written = time.perf_counter(), 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for count in pool.map(_compute_chunk, chunks):
+            written += count
+    elapsed = time.perf_counter() - start
+    print(f"Precomputed {written} feeds in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f} users/s).")
+
+if __name__ == "__main__":
+    precompute_feeds()
@@ -1,3 +1,6 @@
+import time
+STARTED = time.perf_counter()
+
 from flask import Flask, request, jsonify, render_template
 from model import PersonalizedFeed
 
@@ -7,6 +10,7 @@ app = Flask(__name__, template_folder='../templates')
 DATA_FILE = 'data/Ecommerce_Consumer_Behavior_Analysis_Data.csv'
 WEIGHTS_FILE = 'data/user_weight_profiles.json'
 model = PersonalizedFeed(data_filepath=DATA_FILE, weights_filepath=WEIGHTS_FILE)
+print(f"STARTUP: API ready in {(time.perf_counter() - STARTED) * 1000:.0f} ms (model {model.startup_seconds * 1000:.0f} ms).")
 
 # --- API ENDPOINTS ---
 
@@ -1,6 +1,9 @@
-import pandas as pd
-import json
-from sklearn.cluster import KMeans
+import os
+import time
+from datetime import datetime, UTC
+import numpy as np
+from weight_store import WeightStore
+# pandas and scikit-learn are imported only when the model is refitted from the CSV
 
 # Default starting weights for new users
 DEFAULT_WEIGHTS = {
@@ -8,48 +11,106 @@ DEFAULT_WEIGHTS = {
     "x1_cancelled": -0.9, "x2_repeating": 1.0, "x3_search": 0.8, "x4_seen": 0.3,
 }
 LEARNING_RATE = 0.05
+SNAPSHOT_FORMAT = 1   # Bumped whenever the arrays stored in a snapshot change
+
+def _source_fingerprint(path):
+    # A snapshot is reused only while the CSV it was fitted from is unchanged
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
 
 class PersonalizedFeed:
-    def __init__(self, data_filepath, weights_filepath):
-        self.user_item_df = pd.read_csv(data_filepath)
-        self.user_item_df['rating'] = 1
-        self.user_vectors = self._create_user_vectors()
-        self.user_cluster_map = self._cluster_users()
+    def __init__(self, data_filepath, weights_filepath, snapshot_filepath=None):
+        started = time.perf_counter()
+        self.data_filepath = data_filepath
+        self.snapshot_filepath = snapshot_filepath or os.path.splitext(data_filepath)[0] + '.snapshot.npz'
+        source = _source_fingerprint(data_filepath)
+        if self._load_snapshot(source): loaded_from = 'snapshot'
+        else:
+            self._fit()
+            self.save_snapshot(source)
+            loaded_from = 'CSV'
+        self._build_scoring_arrays()
         self.weights_filepath = weights_filepath
-        self.user_weight_profiles = self._load_user_weights()
-        print("Model initialized. User clusters and weight profiles are loaded.")
+        self.weight_store = self._open_weight_store()
+        self.startup_seconds = time.perf_counter() - started
+        print(f"Model initialized from {loaded_from} in {self.startup_seconds * 1000:.0f} ms. User clusters and weight profiles are loaded.")
+
+    def _fit(self):
+        import pandas as pd
+        user_item_df = pd.read_csv(self.data_filepath)
+        user_item_df['rating'] = 1
+        user_vectors = self._create_user_vectors(user_item_df)
+        self.user_ids = np.asarray(user_vectors.index.tolist())   # int or str ids, so no pickling is needed
+        self.categories = [str(c) for c in user_vectors.columns]
+        self.vectors = user_vectors.to_numpy(dtype=np.float64)
+        self.user_clusters = self._cluster_users(self.vectors)
 
-    def _create_user_vectors(self):
-        matrix = self.user_item_df.pivot_table(index='Customer_ID', columns='Purchase_Category', values='rating').fillna(0)
+    def _create_user_vectors(self, user_item_df):
+        matrix = user_item_df.pivot_table(index='Customer_ID', columns='Purchase_Category', values='rating').fillna(0)
         return matrix
 
-    def _cluster_users(self, n_clusters=10):
+    def _cluster_users(self, vectors, n_clusters=10):
+        from sklearn.cluster import KMeans
         kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init='auto')
-        clusters = kmeans.fit_predict(self.user_vectors)
-        return pd.Series(clusters, index=self.user_vectors.index).to_dict()
+        return kmeans.fit_predict(vectors).astype(np.int64)
+
+    def save_snapshot(self, source):
+        """Writes the fitted state as a versioned .npz, replacing the old snapshot atomically."""
+        tmp_path = f"{self.snapshot_filepath}.tmp.npz"
+        np.savez(
+            tmp_path,
+            format_version=np.int64(SNAPSHOT_FORMAT),
+            source=np.array(source),
+            created_at=np.array(datetime.now(UTC).isoformat().replace('+00:00', 'Z')),
+            user_ids=self.user_ids,
+            categories=np.array(self.categories, dtype=str),
+            vectors=self.vectors,
+            user_clusters=self.user_clusters,
+        )
+        os.replace(tmp_path, self.snapshot_filepath)
 
-    def _load_user_weights(self):
+    def _load_snapshot(self, source):
         try:
-            with open(self.weights_filepath, 'r') as f: return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError): return {}
+            with np.load(self.snapshot_filepath) as snapshot:
+                if int(snapshot['format_version']) != SNAPSHOT_FORMAT or str(snapshot['source']) != source: return False
+                self.snapshot_created_at = str(snapshot['created_at'])
+                self.user_ids = snapshot['user_ids']
+                self.categories = snapshot['categories'].tolist()
+                self.vectors = snapshot['vectors']
+                self.user_clusters = snapshot['user_clusters']
+            return True
+        except (OSError, KeyError, ValueError): return False
+
+    def _build_scoring_arrays(self):
+        # Integer indexes for users and categories plus per-cluster mean vectors, computed once
+        self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids.tolist())}
+        self.user_cluster_map = dict(zip(self.user_ids.tolist(), self.user_clusters.tolist()))
+        self.category_index = {category: i for i, category in enumerate(self.categories)}
+        n_clusters = int(self.user_clusters.max()) + 1 if len(self.user_clusters) else 0
+        sums = np.zeros((n_clusters, len(self.categories)))
+        np.add.at(sums, self.user_clusters, self.vectors)
+        sizes = np.bincount(self.user_clusters, minlength=n_clusters).astype(np.float64)
+        self.cluster_means = sums / np.maximum(sizes, 1)[:, None]
+
+    @property
+    def user_vectors(self):
+        import pandas as pd
+        return pd.DataFrame(self.vectors, index=self.user_ids, columns=self.categories)
 
-    def _save_user_weights(self):
-        with open(self.weights_filepath, 'w') as f: json.dump(self.user_weight_profiles, f, indent=4)
+    def _open_weight_store(self):
+        # Profiles live in an SQLite file next to the legacy JSON, which seeds it on first start
+        db_path = os.path.splitext(self.weights_filepath)[0] + '.db'
+        return WeightStore(db_path, legacy_json_path=self.weights_filepath)
 
     def _get_user_weights(self, user_id):
-        user_id_str = str(user_id)
-        if user_id_str not in self.user_weight_profiles:
-            self.user_weight_profiles[user_id_str] = DEFAULT_WEIGHTS.copy()
-        return self.user_weight_profiles[user_id_str]
+        return self.weight_store.get(user_id) or DEFAULT_WEIGHTS.copy()
 
     def get_collab_score(self, user_id):
-        if user_id not in self.user_cluster_map: return pd.Series(dtype=float)
-        target_cluster = self.user_cluster_map[user_id]
-        cluster_users = [u for u, c in self.user_cluster_map.items() if c == target_cluster]
-        cluster_vectors = self.user_vectors.loc[cluster_users]
-        return cluster_vectors.sum(axis=0) / len(cluster_users)
+        import pandas as pd
+        if user_id not in self.user_index: return pd.Series(dtype=float)
+        return pd.Series(self.cluster_means[self.user_clusters[self.user_index[user_id]]], index=self.categories)
 
-    def get_user_score(self, recent_user_actions, weights):
+    def _user_scores(self, recent_user_actions, weights):
         user_scores = {}
         action_map = {"cancelled_order": "x1_cancelled", "repeating_order": "x2_repeating", "search": "x3_search", "seen": "x4_seen"}
         for action_type, items in recent_user_actions.items():
@@ -57,34 +118,79 @@ class PersonalizedFeed:
             if weight_key:
                 weight = weights.get(weight_key, 0)
                 for item in items: user_scores[item] = user_scores.get(item, 0) + weight
-        return pd.Series(user_scores)
+        return user_scores
 
-    def get_business_score(self, business_items):
+    def _business_scores(self, business_items):
         business_scores = {}
         for item in business_items.get('promoted', []) + business_items.get('trending', []): business_scores[item] = 1.0
-        return pd.Series(business_scores)
+        return business_scores
+
+    def get_user_score(self, recent_user_actions, weights):
+        import pandas as pd
+        return pd.Series(self._user_scores(recent_user_actions, weights))
+
+    def get_business_score(self, business_items):
+        import pandas as pd
+        return pd.Series(self._business_scores(business_items))
+
+    def _extra_scores(self, recent_user_actions, business_items, weights):
+        # Scores for labels from recent actions and business items; they may or may not be categories
+        scores = {}
+        for label, score in self._user_scores(recent_user_actions, weights).items(): scores[label] = scores.get(label, 0) + weights['w2_user'] * score
+        for label, score in self._business_scores(business_items).items(): scores[label] = scores.get(label, 0) + weights['w3_business'] * score
+        return scores
+
+    def _top_n(self, scores, labels, n):
+        # scores is users x labels with masked entries at -inf; returns one {label: score} dict per row
+        k = min(n, scores.shape[1])
+        if k == 0: return [{} for _ in range(scores.shape[0])]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        return [{labels[j]: float(v) for j, v in zip(row, values) if v != -np.inf} for row, values in zip(top, top_scores)]
 
     def get_feed_recommendations(self, user_id, recent_user_actions, business_items, n=10):
-        weights = self._get_user_weights(user_id)
-        s_collab = self.get_collab_score(user_id)
-        s_user = self.get_user_score(recent_user_actions, weights)
-        s_business = self.get_business_score(business_items)
-        final_scores = (weights['w1_collab'] * s_collab).add(weights['w2_user'] * s_user, fill_value=0).add(weights['w3_business'] * s_business, fill_value=0)
-        interacted_items = self.user_vectors.loc[user_id][self.user_vectors.loc[user_id] > 0].index
-        final_scores = final_scores.drop(index=interacted_items, errors='ignore')
-        return final_scores.sort_values(ascending=False).head(n).to_dict()
+        return self.get_feed_recommendations_batch([user_id], {user_id: recent_user_actions}, business_items, n)[user_id]
+
+    def get_feed_recommendations_batch(self, user_ids, recent_user_actions, business_items, n=10):
+        """Scores many users in one vectorized pass. recent_user_actions maps user_id -> that user's actions."""
+        rows = np.array([self.user_index[user_id] for user_id in user_ids], dtype=np.int64)   # KeyError for unknown users
+        stored = self.weight_store.get_many(user_ids)
+        user_weights = [stored.get(str(user_id)) or DEFAULT_WEIGHTS.copy() for user_id in user_ids]
+        extras = [self._extra_scores(recent_user_actions.get(user_id, {}), business_items, w) for user_id, w in zip(user_ids, user_weights)]
+
+        # Label space: every category, then any other label mentioned by actions or business items
+        labels = list(self.categories)
+        label_index = dict(self.category_index)
+        for scores in extras:
+            for label in scores:
+                if label not in label_index:
+                    label_index[label] = len(labels)
+                    labels.append(label)
+
+        w1 = np.array([w['w1_collab'] for w in user_weights])
+        final_scores = np.zeros((len(user_ids), len(labels)))
+        final_scores[:, :len(self.categories)] = w1[:, None] * self.cluster_means[self.user_clusters[rows]]
+        for i, scores in enumerate(extras):
+            for label, score in scores.items(): final_scores[i, label_index[label]] += score
+
+        # Drop categories the user has already interacted with
+        final_scores[:, :len(self.categories)][self.vectors[rows] > 0] = -np.inf
+        return dict(zip(user_ids, self._top_n(final_scores, labels, n)))
 
     def update_user_weights(self, user_id, dominant_signal):
-        user_id_str = str(user_id)
-        weights = self._get_user_weights(user_id_str)
-        if dominant_signal in ['search', 'seen', 'repeating_order']:
-            weights['w2_user'] = min(1.0, weights['w2_user'] + LEARNING_RATE)
-            weights['w1_collab'] = max(0.0, weights['w1_collab'] - LEARNING_RATE)
-            if dominant_signal == 'search': weights['x3_search'] += LEARNING_RATE
-            elif dominant_signal == 'seen': weights['x4_seen'] += LEARNING_RATE
-        elif dominant_signal == 'collab':
-            weights['w1_collab'] = min(1.0, weights['w1_collab'] + LEARNING_RATE)
-            weights['w2_user'] = max(0.0, weights['w2_user'] - LEARNING_RATE)
-        self.user_weight_profiles[user_id_str] = weights
-        self._save_user_weights()
-        return weights
\ No newline at end of file
+        def apply(weights):
+            if dominant_signal in ['search', 'seen', 'repeating_order']:
+                weights['w2_user'] = min(1.0, weights['w2_user'] + LEARNING_RATE)
+                weights['w1_collab'] = max(0.0, weights['w1_collab'] - LEARNING_RATE)
+                if dominant_signal == 'search': weights['x3_search'] += LEARNING_RATE
+                elif dominant_signal == 'seen': weights['x4_seen'] += LEARNING_RATE
+            elif dominant_signal == 'collab':
+                weights['w1_collab'] = min(1.0, weights['w1_collab'] + LEARNING_RATE)
+                weights['w2_user'] = max(0.0, weights['w2_user'] - LEARNING_RATE)
+        return self.weight_store.update(user_id, DEFAULT_WEIGHTS, apply)
+
+    def snapshot_user_weights(self, path=None):
+        """Exports every profile to the legacy JSON format (by default over weights_filepath)."""
+        return self.weight_store.snapshot(path or self.weights_filepath)
@@ -0,0 +1,93 @@
+import json
+import os
+import sqlite3
+import threading
+
+BUSY_TIMEOUT = 30.0   # Seconds a writer waits for another worker's transaction
+
+
+class WeightStore:
+    """
+    Per-user weight profiles in an SQLite table running in WAL mode. Each update rewrites one row
+    inside its own transaction, so the cost does not grow with the number of users and several
+    API workers (threads or processes) can share the file safely.
+    On first start the table is seeded from the legacy user_weight_profiles.json.
+    """
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self.local = threading.local()   # sqlite3 connections must stay on the thread that opened them
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS user_weights (user_id TEXT PRIMARY KEY, weights TEXT NOT NULL)")
+        if legacy_json_path: self._import_json(legacy_json_path)
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _import_json(self, path):
+        try:
+            with open(path, 'r') as f: profiles = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError): return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have imported already; only an empty table is seeded
+            if conn.execute("SELECT 1 FROM user_weights LIMIT 1").fetchone() is None:
+                conn.executemany(
+                    "INSERT INTO user_weights (user_id, weights) VALUES (?, ?)",
+                    [(str(user_id), json.dumps(weights)) for user_id, weights in profiles.items()]
+                )
+                print(f"WEIGHT_STORE: Imported {len(profiles)} profiles from '{path}'.")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, user_id):
+        row = self._conn().execute("SELECT weights FROM user_weights WHERE user_id = ?", (str(user_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, user_ids):
+        """{user_id: weights} for the given users that have a stored profile."""
+        keys = list({str(user_id) for user_id in user_ids})
+        found = {}
+        for start in range(0, len(keys), 500):   # Stay under SQLite's bound-parameter limit
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for user_id, weights in self._conn().execute(f"SELECT user_id, weights FROM user_weights WHERE user_id IN ({placeholders})", chunk):
+                found[user_id] = json.loads(weights)
+        return found
+
+    def update(self, user_id, default, apply):
+        """
+        Read-modify-write of one profile under a write lock: apply(weights) mutates a copy of the
+        stored weights (or of default) and the result is written back and returned.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT weights FROM user_weights WHERE user_id = ?", (str(user_id),)).fetchone()
+            weights = json.loads(row[0]) if row else dict(default)
+            apply(weights)
+            conn.execute("INSERT OR REPLACE INTO user_weights (user_id, weights) VALUES (?, ?)", (str(user_id), json.dumps(weights)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return weights
+
+    def snapshot(self, path):
+        """Writes a consistent copy of all profiles in the legacy JSON format, replacing path atomically."""
+        conn = self._conn()
+        conn.execute("BEGIN")   # One read transaction, so concurrent updates are either fully in or out
+        try: profiles = {user_id: json.loads(weights) for user_id, weights in conn.execute("SELECT user_id, weights FROM user_weights")}
+        finally: conn.execute("COMMIT")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f: json.dump(profiles, f, indent=4)
+        os.replace(tmp_path, path)
+        return len(profiles)